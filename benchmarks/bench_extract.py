@@ -0,0 +1,65 @@
+"""Compare the ways of getting the sort fields of the records in the split loop.
+
+Usage:
+    python benchmarks/bench_extract.py FILE [--limit N] [--repeat R]
+
+FILE is a WikiConv dump, can be compressed. The "json" path is the one
+used before the raw lines were written through unchanged: decode the whole
+record and encode it again.
+"""
+import argparse
+import importlib
+import itertools
+import json
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+fields = importlib.import_module('wikiconv-sort.fields')
+file_utils = importlib.import_module('wikiconv-sort.file_utils')
+
+
+def json_roundtrip(lines):
+    for line in lines:
+        obj = json.loads(line)
+        json.dumps(obj).encode('utf-8')
+
+
+def extract_fields(lines):
+    for line in lines:
+        fields.extract_fields(line)
+
+
+def orjson_loads(lines):
+    for line in lines:
+        fields.orjson.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file', metavar='FILE', type=pathlib.Path)
+    parser.add_argument('--limit', type=int, default=100000, help='Number of records [default: 100000].')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions, the best is kept [default: 3].')
+    args = parser.parse_args()
+
+    with file_utils.open_jsonlines_file(str(args.file)) as f:
+        lines = list(itertools.islice(f, args.limit))
+    size = sum(map(len, lines))
+
+    paths = [('json.loads + json.dumps', json_roundtrip), ('fields.extract_fields', extract_fields)]
+    if fields.orjson is not None:
+        paths.append(('orjson.loads', orjson_loads))
+
+    print(f"{len(lines)} records, {size / 1024 ** 2:.1f} MiB")
+    for name, path in paths:
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            path(lines)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:<25} {best / len(lines) * 1e6:8.2f} us/record {size / best / 1024 ** 2:8.1f} MiB/s")
+
+
+if __name__ == '__main__':
+    main()
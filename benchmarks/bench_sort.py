@@ -0,0 +1,131 @@
+"""Time the split, the sort and the whole run for each sorting field and
+output compression.
+
+Usage:
+    python benchmarks/bench_sort.py FILE [FILE ...] [--sort-by user,page]
+        [--compression none,gz] [--stages split,sort,e2e] [--repeat R]
+        [--output RESULTS.jsonl]
+
+FILE is a WikiConv dump, e.g. written by generate_data.py. Each
+measurement runs in its own process, which reports its peak RSS, and that
+of the largest process it started. Throughput is in records and in MiB of
+decompressed input per second, as written by the split in the metrics of
+the run. Results are printed and, with --output, appended as JSON lines to
+compare the numbers before and after a change.
+
+    split  split the input files into buckets, kept on disk
+    sort   sort the buckets written by a split, one at a time
+    e2e    sortFiles, as run by the command line
+"""
+import argparse
+import importlib
+import json
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+metrics = importlib.import_module('wikiconv-sort.metrics')
+sorter = importlib.import_module('wikiconv-sort.sorter')
+
+STAGES = ['split', 'sort', 'e2e']
+SORT_FIELDS = ['user', 'page', 'replyToUser', 'date']
+COMPRESSIONS = ['none', 'gz', 'bz2']
+BUCKET_SIZE = 200000
+
+
+def split_metrics(output_path: pathlib.Path):
+    """Return the records and bytes read by the splits of a run."""
+    records = size = 0
+    with open(output_path / metrics.METRICS_FILENAME) as f:
+        for line in f:
+            event = json.loads(line)
+            if event['event'] == 'split':
+                records += event['records']
+                size += event['bytesRead']
+    return records, size
+
+
+def run_stage(stage, files, sort_by, compression, work_dir):
+    """Run a stage and return its seconds, and the records and bytes read."""
+    output_path = pathlib.Path(work_dir)
+    compression = None if compression == 'none' else compression
+    if stage == 'e2e':
+        start = time.perf_counter()
+        sorter.sortFiles(files, output_path, BUCKET_SIZE, compression, sort_by)
+        seconds = time.perf_counter() - start
+    else:
+        # Buckets are written to disk, as they are for large inputs
+        start = time.perf_counter()
+        buckets = sorter.splitFiles(files, output_path, BUCKET_SIZE, compression, sort_by, inMemoryThreshold=0)
+        seconds = time.perf_counter() - start
+        if stage == 'sort':
+            start = time.perf_counter()
+            for (field, number), bucket in sorted(buckets.items()):
+                sortedFilename = str(output_path / f"wikiconv-sort-{field}-{number:04}.json")
+                sorter.sort(bucket.filenames, sortedFilename, field, compression, output_path, tmpCompression=compression)
+            seconds = time.perf_counter() - start
+    return (seconds, *split_metrics(output_path))
+
+
+def measure(stage, files, sort_by, compression):
+    """Run a stage in a new process and return its results."""
+    with tempfile.TemporaryDirectory(prefix='bench-sort-') as work_dir:
+        result = subprocess.run(
+            [sys.executable, __file__, '--run-stage', stage, '--sort-by', ','.join(sort_by),
+             '--compression', compression, '--work-dir', work_dir, *map(str, files)],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    return json.loads(result.stdout.decode('utf-8').splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', metavar='FILE', type=pathlib.Path, nargs='+')
+    parser.add_argument('--sort-by', default='user,page', help='Comma-separated sorting fields, each timed on its own, '
+                        'or several joined by + to sort them in a single pass [default: user,page].')
+    parser.add_argument('--compression', default='none,gz', help='Comma-separated output compressions [default: none,gz].')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"Comma-separated stages [default: {','.join(STAGES)}].")
+    parser.add_argument('--repeat', type=int, default=1, help='Repetitions, the fastest is kept [default: 1].')
+    parser.add_argument('--output', type=pathlib.Path, default=None, help='Append the results to this JSON lines file.')
+    parser.add_argument('--run-stage', choices=STAGES, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage is not None:
+        seconds, records, size = run_stage(args.run_stage, args.files, args.sort_by.split(','), args.compression, args.work_dir)
+        print(json.dumps({
+            'seconds': seconds,
+            'records': records,
+            'bytes': size,
+            # KiB on Linux
+            'peakRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'peakChildRss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        }))
+        return
+
+    print(f"{'stage':<6} {'sort by':<12} {'compr.':<6} {'seconds':>8} {'rec/s':>9} {'MiB/s':>7} {'RSS MiB':>8} {'child MiB':>9}")
+    for stage in args.stages.split(','):
+        for sort_by in args.sort_by.split(','):
+            for compression in args.compression.split(','):
+                results = [measure(stage, args.files, sort_by.split('+'), compression) for _ in range(args.repeat)]
+                best = min(results, key=lambda result: result['seconds'])
+                best.update(stage=stage, sortBy=sort_by, compression=compression)
+                print(
+                    f"{stage:<6} {sort_by:<12} {compression:<6} {best['seconds']:8.2f} "
+                    f"{best['records'] / best['seconds']:9.0f} {best['bytes'] / best['seconds'] / 1024 ** 2:7.1f} "
+                    f"{best['peakRss'] / 1024 ** 2:8.0f} {best['peakChildRss'] / 1024 ** 2:9.0f}",
+                    flush=True
+                )
+                if args.output is not None:
+                    with open(args.output, 'a') as f:
+                        f.write(json.dumps(best) + '\n')
+
+
+if __name__ == '__main__':
+    main()
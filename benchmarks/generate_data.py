@@ -0,0 +1,161 @@
+"""Generate synthetic WikiConv dumps to benchmark the sort on.
+
+Usage:
+    python benchmarks/generate_data.py OUTPUT_DIR [--files N] [--records N]
+        [--compression {none,gz,bz2}] [--seed S]
+
+Records follow the schema in `types.py`. Pages, registered users and IP
+addresses are drawn from Zipf distributions, so that a few of them get most
+of the records as in the real dumps, and a part of the records are by
+anonymous users, some of them with IPv6 addresses. The same seed gives the
+same files.
+"""
+import argparse
+import bz2
+import gzip
+import itertools
+import json
+import pathlib
+import random
+import string
+from datetime import datetime, timezone
+
+TYPES = ['ADDITION', 'CREATION', 'MODIFICATION', 'DELETION', 'RESTORATION']
+TYPE_WEIGHTS = [70, 10, 10, 8, 2]
+# Talk, user talk, project talk and the others
+NAMESPACES = [1, 3, 5, 7, 11, 13, 101]
+NAMESPACE_WEIGHTS = [70, 20, 4, 2, 2, 1, 1]
+WORDS = [''.join(random.Random(i).choices(string.ascii_lowercase, k=1 + i % 9)) for i in range(2000)]
+FIRST_TIMESTAMP = datetime(2002, 1, 1, tzinfo=timezone.utc).timestamp()
+LAST_TIMESTAMP = datetime(2018, 12, 31, tzinfo=timezone.utc).timestamp()
+
+
+class Zipf:
+    """Values drawn with probability decreasing as 1/rank^`exponent`, the
+    values are shuffled so that the frequent ones are not the smallest."""
+
+    def __init__(self, rng: random.Random, values: list, exponent: float):
+        self.rng = rng
+        self.values = values
+        rng.shuffle(self.values)
+        self.cum_weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, len(values) + 1)))
+
+    def draw(self):
+        return self.rng.choices(self.values, cum_weights=self.cum_weights)[0]
+
+
+def ipv4(rng: random.Random) -> str:
+    return '.'.join(str(rng.randrange(1, 255)) for _ in range(4))
+
+
+def ipv6(rng: random.Random) -> str:
+    return ':'.join(f"{rng.randrange(0x10000):x}" for _ in range(8))
+
+
+def text(rng: random.Random, mean_words: int) -> str:
+    nwords = max(1, int(rng.lognormvariate(0, 1) * mean_words))
+    return ' '.join(rng.choices(WORDS, k=nwords))
+
+
+class Generator:
+    """Generator of records of `pages` pages, `users` registered users and
+    `ips` addresses of anonymous users."""
+
+    def __init__(
+            self,
+            seed: int = 0,
+            pages: int = 100000,
+            users: int = 50000,
+            ips: int = 50000,
+            anonymous: float = 0.3,
+            ipv6_share: float = 0.1,
+            exponent: float = 1.1
+        ):
+        self.rng = random.Random(seed)
+        self.anonymous = anonymous
+        self.pages = Zipf(self.rng, self.rng.sample(range(1, 60000000), pages), exponent)
+        self.users = Zipf(self.rng, self.rng.sample(range(1, 35000000), users), exponent)
+        self.ips = Zipf(
+            self.rng,
+            [ipv6(self.rng) if self.rng.random() < ipv6_share else ipv4(self.rng) for _ in range(ips)],
+            exponent
+        )
+        self.rev_id = itertools.count(self.rng.randrange(1, 1000000))
+
+    def user(self) -> dict:
+        if self.rng.random() < self.anonymous:
+            return {'ip': self.ips.draw()}
+        user_id = self.users.draw()
+        return {'id': str(user_id), 'text': f"User{user_id}"}
+
+    def record(self) -> dict:
+        rng = self.rng
+        rev_id = next(self.rev_id)
+        page_id = self.pages.draw()
+        conversation_id = f"{rev_id}.{rng.randrange(1000)}.{rng.randrange(1000)}"
+        content = text(rng, 40)
+        record = {
+            'id': f"{rev_id}.{rng.randrange(1000)}.{rng.randrange(1000)}",
+            'revId': str(rev_id),
+            'type': rng.choices(TYPES, TYPE_WEIGHTS)[0],
+            'conversationId': conversation_id,
+            'pageTitle': f"Talk:Page {page_id}",
+            'content': content,
+            'cleanedContent': content,
+            'user': self.user(),
+            'timestamp': datetime.fromtimestamp(
+                rng.uniform(FIRST_TIMESTAMP, LAST_TIMESTAMP), timezone.utc
+            ).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'pageId': str(page_id),
+            'ancestorId': conversation_id,
+            'authorList': [self.user() for _ in range(rng.randrange(1, 4))],
+            'score': {
+                name: rng.random() ** 4
+                for name in ('toxicity', 'severeToxicity', 'profanity', 'threat', 'insult', 'identityAttack')
+            },
+            'pageNamespace': rng.choices(NAMESPACES, NAMESPACE_WEIGHTS)[0],
+        }
+        if rng.random() < 0.6:
+            record['parentId'] = f"{rev_id - rng.randrange(1, 1000)}.0.0"
+        if rng.random() < 0.5:
+            record['replyToUser'] = self.user()
+        if rng.random() < 0.3:
+            record['comment'] = text(rng, 5)
+        return record
+
+
+def open_output(path: pathlib.Path, compression: str):
+    if compression == 'gz':
+        return gzip.open(path, 'wb', compresslevel=6)
+    elif compression == 'bz2':
+        return bz2.open(path, 'wb')
+    return open(path, 'wb')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output_dir', metavar='OUTPUT_DIR', type=pathlib.Path)
+    parser.add_argument('--files', type=int, default=4, help='Number of files [default: 4].')
+    parser.add_argument('--records', type=int, default=100000, help='Records of each file [default: 100000].')
+    parser.add_argument('--compression', choices=['none', 'gz', 'bz2'], default='gz', help='[default: gz].')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed [default: 0].')
+    parser.add_argument('--pages', type=int, default=100000, help='Number of pages [default: 100000].')
+    parser.add_argument('--users', type=int, default=50000, help='Number of registered users [default: 50000].')
+    parser.add_argument('--ips', type=int, default=50000, help='Number of IP addresses [default: 50000].')
+    parser.add_argument('--anonymous', type=float, default=0.3, help='Share of anonymous users [default: 0.3].')
+    parser.add_argument('--exponent', type=float, default=1.1, help='Exponent of the Zipf distributions [default: 1.1].')
+    args = parser.parse_args()
+
+    generator = Generator(args.seed, args.pages, args.users, args.ips, args.anonymous, exponent=args.exponent)
+    suffix = '' if args.compression == 'none' else f".{args.compression}"
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(args.files):
+        path = args.output_dir / f"wikiconv-synthetic-{i + 1:04}.json{suffix}"
+        with open_output(path, args.compression) as f:
+            for _ in range(args.records):
+                f.write(json.dumps(generator.record()).encode('utf-8') + b'\n')
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
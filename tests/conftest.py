@@ -0,0 +1,29 @@
+import json
+import pathlib
+import random
+import sys
+
+import pytest
+
+# The package directory, wikiconv-sort, is imported with importlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def write_records():
+    """Return a function writing `n` random records with `seed` as JSON
+    lines to `path`, and returning them."""
+    def write(path, n, seed):
+        rng = random.Random(seed)
+        records = []
+        for i in range(n):
+            records.append({
+                'id': f"{rng.randrange(1, 10 ** 6)}.{rng.randrange(1000)}.{i}",
+                'pageId': str(rng.randrange(100, 1000)),
+                'timestamp': f"{rng.randrange(2001, 2019)}-{rng.randrange(1, 13):02}-{rng.randrange(1, 29):02}T12:00:00Z",
+                'user': {'id': str(rng.randrange(1, 1000)), 'text': 'User'},
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+        return records
+    return write
@@ -0,0 +1,36 @@
+"""The lookup of a key range in indexed outputs returns the records of the
+range, in order."""
+import importlib
+import json
+
+import pytest
+
+lookup = importlib.import_module('wikiconv-sort.lookup')
+sorter = importlib.import_module('wikiconv-sort.sorter')
+
+
+def ids(lines):
+    return [json.loads(line.split(b'\t', 1)[1])['id'] for line in lines]
+
+
+def test_lookup(tmp_path, write_records):
+    records = write_records(tmp_path / 'a.json', 3000, 0)
+    output_path = tmp_path / 'output'
+    output_path.mkdir()
+    sorter.sortFiles([tmp_path / 'a.json'], output_path, 100, None, ['page', 'date'], sortJobs=2, index=True)
+
+    by_page = lookup.Lookup(output_path, 'page')
+    page_id = records[0]['pageId']
+    expected = sorted((obj for obj in records if obj['pageId'] == page_id), key=sorter.SORT_KEYS['page'])
+    assert ids(by_page.records(page_id)) == [obj['id'] for obj in expected]
+    expected = [obj for obj in expected if '2005-03' <= obj['timestamp'] < '2009']
+    assert ids(by_page.records(page_id, '2005-03', '2008')) == [obj['id'] for obj in expected]
+
+    by_date = lookup.Lookup(output_path, 'date')
+    expected = sorted((obj for obj in records if '2007-10' <= obj['timestamp'] < '2008-02'), key=sorter.SORT_KEYS['date'])
+    assert expected
+    assert ids(by_date.records(since='2007-10', until='2008-01')) == [obj['id'] for obj in expected]
+
+    # The page keys do not start with the timestamp
+    with pytest.raises(ValueError):
+        list(by_page.records(since='2007-10'))
@@ -0,0 +1,55 @@
+"""Records are written to Parquet files with the schema of `columnar`."""
+import importlib
+import json
+
+import pytest
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.parquet  # noqa: E402
+
+columnar = importlib.import_module('wikiconv-sort.columnar')
+
+RECORD = {
+    'id': '168283361.0.312',
+    'revId': '168283361',
+    'type': 'DELETION',
+    'conversationId': '11458020.300.300',
+    'pageTitle': 'Talk:The Case for Faith',
+    'content': 'Moved page',
+    'cleanedContent': 'Moved page',
+    'user': {'id': '3939239', 'text': 'Hrafn'},
+    'timestamp': '2007-10-31T11:54:56Z',
+    'pageId': '1642201',
+    'parentId': '11458195.312.312',
+    'ancestorId': '11458020.312.300',
+    'authorList': [{'id': '86737', 'text': 'SocratesJedi'}],
+    'score': {
+        'toxicity': 0.01,
+        'severeToxicity': 0.02,
+        'profanity': 0.03,
+        'threat': 0.04,
+        'insult': 0.05,
+        'identityAttack': 0.06,
+    },
+    'pageNamespace': 1,
+}
+
+
+def test_string_users(tmp_path):
+    records = [
+        RECORD,
+        dict(RECORD, user='root', replyToUser='unknown', authorList=['root']),
+        dict(RECORD, user={'ip': '10.0.0.1'}),
+    ]
+    lines = [b'key\t' + json.dumps(record).encode('utf-8') + b'\n' for record in records]
+    path = str(tmp_path / 'records.parquet')
+    assert columnar.write_lines(path, None, lines, lambda key: key.decode('utf-8')) == 3
+
+    table = pyarrow.parquet.read_table(path, columns=['user', 'replyToUser', 'authorList'])
+    assert table.column('user').to_pylist() == [
+        {'id': 3939239, 'text': 'Hrafn', 'ip': None},
+        {'id': None, 'text': 'root', 'ip': None},
+        {'id': None, 'text': None, 'ip': '10.0.0.1'},
+    ]
+    assert table.column('replyToUser').to_pylist()[1] == {'id': None, 'text': 'unknown', 'ip': None}
+    assert table.column('authorList').to_pylist()[1] == [{'id': None, 'text': 'root', 'ip': None}]
@@ -0,0 +1,55 @@
+"""An interrupted run resumed from its manifest sorts the records as a run
+that was not interrupted."""
+import importlib
+import os
+import stat
+
+import pytest
+
+manifest = importlib.import_module('wikiconv-sort.manifest')
+sorter = importlib.import_module('wikiconv-sort.sorter')
+
+
+def outputs(path):
+    files = {}
+    for name in sorted(os.listdir(path)):
+        if name.startswith('wikiconv-sort-'):
+            with open(os.path.join(path, name), 'rb') as f:
+                files[name] = f.read()
+    return files
+
+
+def sort(inputs, output_path, **kwargs):
+    sorter.sortFiles(inputs, output_path, 100, None, 'page', sortJobs=2, **kwargs)
+
+
+@pytest.mark.parametrize('checkpoint_size', [None, 1024 ** 3])
+def test_resume(tmp_path, checkpoint_size, write_records):
+    inputs = [tmp_path / 'a.json', tmp_path / 'b.json']
+    write_records(inputs[0], 500, 0)
+    with open(inputs[1], 'w') as f:
+        f.write('not a record\n')
+    resumed = tmp_path / 'resumed'
+    resumed.mkdir()
+    with pytest.raises(ValueError):
+        sort(inputs, resumed, checkpointSize=checkpoint_size)
+    # Without checkpoints both input files are split again
+    split = manifest.read(resumed)['split']
+    assert (str(inputs[0]) in split) == (checkpoint_size is not None)
+
+    write_records(inputs[1], 500, 1)
+    sort(inputs, resumed, resume=True, checkpointSize=checkpoint_size)
+    state = manifest.read(resumed)
+    assert state['session'] == 1
+    assert not any(name.startswith(sorter.BUCKET_FILE_PREFIX) for name in os.listdir(resumed))
+
+    expected = tmp_path / 'expected'
+    expected.mkdir()
+    sort(inputs, expected)
+    assert outputs(resumed) == outputs(expected)
+    assert sum(bucket['records'] for bucket in state['buckets']) == 1000
+
+
+def test_manifest_mode(tmp_path):
+    manifest.write(tmp_path, {})
+    assert stat.S_IMODE(os.stat(manifest.manifest_path(tmp_path)).st_mode) == manifest.FILE_MODE
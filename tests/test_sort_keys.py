@@ -0,0 +1,166 @@
+"""The binary sort keys sort the records as the comparator strings of the
+GNU sort pipeline did, and their readable form sorts as they do."""
+import bisect
+import importlib
+import json
+import os
+import random
+
+external_sort = importlib.import_module('wikiconv-sort.external_sort')
+sorter = importlib.import_module('wikiconv-sort.sorter')
+
+MAPPED_MEMORY_LIMIT = 16 * 1024
+IPV6_ADDRESSES = ['::1', '2001:db8::1', '2001:db8::ff00:42:8329', 'fe80::1', 'f4e::1', '10ae::1', '194:f648::7']
+INVALID_IPS = ['1.2.3', '', 'Unknown', 'fe80::1%eth0', '1.2.3.256', '1.2.3.a', '1.2.3.4.5', '\u0661.2.3.4']
+INVALID_USER_IDS = ['', '12a', 'ab', '\u0661\u0662', '1' * 13]
+
+
+def comparator_by_date(obj):
+    timestamp = obj['timestamp']
+    year = int(timestamp[:4])
+    month = int(timestamp[5:7])
+    return f"{year * 100 + month} {timestamp} {obj['id']}"
+
+
+def comparator_by_username(obj, user_field='user'):
+    id_segments = obj['id'].split('.')
+    par0 = "000000000"
+    if user_field in obj:
+        user = obj[user_field]
+        if 'ip' in user:
+            par0 = "".join([x.zfill(3) for x in user['ip'].split(".")])
+        elif 'id' in user:
+            par0 = user['id'].zfill(12)
+    return f"{par0} {obj['timestamp']} {id_segments[1].zfill(8)} {id_segments[2].zfill(8)}"
+
+
+def comparator_by_page(obj):
+    id_segments = obj['id'].split('.')
+    return f"{obj['pageId'].zfill(9)} {obj['timestamp']} {id_segments[1].zfill(8)} {id_segments[2].zfill(8)}"
+
+
+# Comparator strings of the records before the binary sort keys
+COMPARATORS = {
+    'date': comparator_by_date,
+    'page': comparator_by_page,
+    'user': comparator_by_username,
+    'replyToUser': lambda obj: comparator_by_username(obj, 'replyToUser'),
+}
+
+
+def make_user(rng, ipv6=True):
+    kind = rng.randrange(3 if ipv6 else 2)
+    if kind == 0:
+        return {'id': str(rng.choice([1, 7, 12, 345, 99999, 123456789, rng.randrange(1, 10 ** 9)])), 'text': 'User'}
+    elif kind == 1:
+        return {'ip': '.'.join(str(rng.choice([0, 1, 9, 10, 99, 100, 192, 255])) for _ in range(4))}
+    return {'ip': rng.choice(IPV6_ADDRESSES)}
+
+
+def make_records(n, ipv6=True, seed=0):
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        records.append({
+            'id': f"{rng.randrange(1, 10 ** 6)}.{rng.randrange(1000)}.{i}",
+            'pageId': str(rng.choice([1, 9, 10, 99, 100, 12345, rng.randrange(1, 10 ** 8)])),
+            'timestamp': f"{rng.randrange(2001, 2019)}-{rng.randrange(1, 13):02}-{rng.randrange(1, 29):02}"
+                         f"T{rng.randrange(24):02}:{rng.randrange(60):02}:{rng.randrange(60):02}Z",
+            'user': make_user(rng, ipv6),
+            'replyToUser': make_user(rng, ipv6),
+        })
+    return records
+
+
+def split(records, sort_by):
+    """Return the records of the sorted buckets, by bucket number."""
+    buckets = {}
+    for obj in records:
+        number = sorter.BUCKET_NUMBER[sort_by](obj, 100000)
+        if number > 0:
+            buckets.setdefault(number, []).append(obj)
+    return buckets
+
+
+def test_keys_sort_as_comparator_strings():
+    # The comparator strings did not order the IPv6 addresses
+    records = make_records(2000, ipv6=False)
+    for sort_by, comparator in COMPARATORS.items():
+        for number, bucket in split(records, sort_by).items():
+            by_key = sorted(bucket, key=sorter.SORT_KEYS[sort_by])
+            by_string = sorted(bucket, key=comparator)
+            assert by_key == by_string, (sort_by, number)
+
+
+def test_readable_keys_sort_as_keys():
+    records = make_records(2000)
+    for sort_by in COMPARATORS:
+        for number, bucket in split(records, sort_by).items():
+            keys = sorted(map(sorter.SORT_KEYS[sort_by], bucket))
+            strings = [sorter.SORT_KEY_STRINGS[sort_by](key) for key in keys]
+            assert strings == sorted(strings), (sort_by, number)
+
+
+def test_readable_keys_sort_as_keys_in_balanced_buckets():
+    records = make_records(2000)
+    for sort_by in ('user', 'replyToUser'):
+        keys = sorted(map(sorter.SORT_KEYS[sort_by], records))
+        boundaries = sorter.computeBoundaries([(key, 1) for key in keys], 3, sorter.USER_BUCKET_STARTS)
+        buckets = {}
+        for key in keys:
+            buckets.setdefault(bisect.bisect_right(boundaries, key), []).append(sorter.SORT_KEY_STRINGS[sort_by](key))
+        for number, strings in buckets.items():
+            assert strings == sorted(strings), (sort_by, number)
+
+
+def test_readable_ipv6_keys():
+    obj = make_records(1)[0]
+    obj['user'] = {'ip': '2001:db8::1'}
+    key = sorter.SORT_KEY_STRINGS['user'](sorter.SORT_KEYS['user'](obj))
+    assert key.split(' ')[0] == 'ipv6:20010db8000000000000000000000001'
+
+
+def test_invalid_users():
+    # Sorted before the other users of the first bucket, as the records
+    # without a user
+    obj = make_records(1)[0]
+    users = [{'ip': ip} for ip in INVALID_IPS] + [{'id': user_id, 'text': 'User'} for user_id in INVALID_USER_IDS]
+    for user in users:
+        obj['user'] = user
+        key = sorter.SORT_KEYS['user'](obj)
+        assert key[:1] == sorter.USER_NONE, user
+        assert b'\t' not in key and b'\n' not in key, user
+        assert sorter.SORT_KEY_STRINGS['user'](key).startswith('000000000 '), user
+        for ip_buckets in (1, 4):
+            assert sorter.BUCKET_NUMBER['user'](obj, 100000, ipBuckets=ip_buckets) == 1, user
+
+
+def write_bucket(path, records, sort_by):
+    lines = [sorter.SORT_KEYS[sort_by](obj) + b'\t' + json.dumps(obj).encode('utf-8') + b'\n' for obj in records]
+    # Records with the same key
+    lines += lines[:50]
+    with open(path, 'wb') as f:
+        f.writelines(lines)
+    return lines
+
+
+def test_mapped_sort_as_read_sort(tmp_path, monkeypatch):
+    records = make_records(3000)
+    # Map the files even if their lines are short
+    monkeypatch.setattr(external_sort, 'MAPPED_LINE_SIZE', 0)
+    for sort_by in COMPARATORS:
+        bucket = str(tmp_path / f"bucket-{sort_by}.json")
+        lines = write_bucket(bucket, records, sort_by)
+        format_line = lambda line, sort_by=sort_by: sorter.formatSortedLine(line, sort_by)
+        outputs = {}
+        # Files larger than the memory limit are sorted through the index of
+        # their map
+        assert os.path.getsize(bucket) > MAPPED_MEMORY_LIMIT
+        for name, memory_limit in [('read', 1024 ** 3), ('mapped', MAPPED_MEMORY_LIMIT)]:
+            output = str(tmp_path / f"{name}-{sort_by}.json")
+            nlines = external_sort.sort_files([bucket], output, None, memory_limit, str(tmp_path), format_line=format_line)
+            assert nlines == len(lines)
+            with open(output, 'rb') as f:
+                outputs[name] = f.read()
+        assert outputs['read'] == outputs['mapped']
+        assert outputs['read'] == b''.join(map(format_line, sorted(lines)))
@@ -1,8 +1,39 @@
 """Main module that parses command line arguments."""
 import argparse
 import pathlib
+import sys
+from typing import List
 
+from . import columnar
+from . import external_sort
+from . import file_utils
+from . import filters
+from . import manifest
 from . import sorter
+from . import sparse_index
+from . import utils
+
+SORT_FIELDS = {'user', 'page', 'replyToUser', 'date'}
+
+
+def parse_sort_by(value: str) -> List[str]:
+    """Parse comma-separated sorting fields."""
+    sort_by = value.split(',')
+    for field in sort_by:
+        if field not in SORT_FIELDS:
+            raise argparse.ArgumentTypeError(f"invalid sorting field: {field!r}")
+    if len(set(sort_by)) < len(sort_by):
+        raise argparse.ArgumentTypeError(f"repeated sorting field: {value!r}")
+    return sort_by
+
+
+def positive_int(value: str) -> int:
+    """Parse an integer greater than zero."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value!r}")
+    return number
+
 
 def get_args():
     """Parse command line arguments."""
@@ -25,15 +56,44 @@ def get_args():
     )
     parser.add_argument(
         'sort_by',
-        choices={ 'user', 'page', 'replyToUser', 'date' },
-        help='Sorting field'
+        type=parse_sort_by,
+        metavar='{user,page,replyToUser,date}',
+        help='Sorting field, or comma-separated fields sorted in a single '
+             'pass, e.g. user,page'
     )
     parser.add_argument(
         '--output-compression',
-        choices={None, '7z', 'bz2', 'gz'},
+        choices={None, '7z', 'bz2', 'gz', 'lz4', 'zst'},
         required=False,
         default=None,
-        help='Output compression format [default: no compression].',
+        help='Output compression format, zst needs zstandard and lz4 needs '
+             'lz4 [default: no compression].',
+    )
+    parser.add_argument(
+        '--tmp-compression',
+        choices={None, 'bz2', 'gz', 'lz4', 'zst'},
+        required=False,
+        default=None,
+        help='Compression format of the temporary bucket files, a fast one '
+             'such as lz4 or zst saves disk space for little time '
+             '[default: no compression].',
+    )
+    parser.add_argument(
+        '--compression-threads',
+        type=positive_int,
+        required=False,
+        default=None,
+        help='Threads compressing the files of each process [default: the '
+             'processors shared by the sort jobs].',
+    )
+    parser.add_argument(
+        '--output-format',
+        choices={'json', 'parquet'},
+        required=False,
+        default='json',
+        help='Output format, sort key and JSON record lines, or Parquet '
+             'files with a column per field, which need pyarrow '
+             '[default: json].',
     )
     parser.add_argument(
         '--dry-run', '-n',
@@ -47,11 +107,232 @@ def get_args():
         default=200000,
         help='Bucket size'
     )
+    parser.add_argument(
+        '--split-workers',
+        type=positive_int,
+        required=False,
+        default=1,
+        help='Number of processes splitting the input files [default: 1].'
+    )
+    parser.add_argument(
+        '--memory-limit',
+        type=utils.parse_size,
+        required=False,
+        default='2G',
+        help='Memory shared by the split workers and by the sort jobs, '
+             'e.g. 512M or 4G [default: 2G].'
+    )
+    parser.add_argument(
+        '--sort-jobs',
+        type=positive_int,
+        required=False,
+        default=None,
+        help='Number of buckets sorted at the same time '
+             '[default: number of processors].'
+    )
+    parser.add_argument(
+        '--tmp-dir',
+        type=pathlib.Path,
+        required=False,
+        default=None,
+        help='Directory for temporary sort runs [default: system temp dir].'
+    )
+    parser.add_argument(
+        '--in-memory-threshold',
+        type=utils.parse_size,
+        required=False,
+        default='64M',
+        help='Buckets smaller than this are sorted in memory, without '
+             'writing them to disk first, unless checkpoints are saved '
+             '[default: 64M].'
+    )
+
+    parser.add_argument(
+        '--max-open-files',
+        type=positive_int,
+        required=False,
+        default=None,
+        help='Maximum number of bucket files open at the same time by each '
+             'splitter [default: a fraction of the open files limit].'
+    )
+    parser.add_argument(
+        '--ip-buckets',
+        type=positive_int,
+        required=False,
+        default=1,
+        help='Number of buckets of the anonymous users when sorting by '
+             'user, split by address range [default: 1].'
+    )
+    parser.add_argument(
+        '--balanced-buckets',
+        type=positive_int,
+        required=False,
+        default=None,
+        metavar='N',
+        help='Sample the input files and split the records into N buckets '
+             'of about the same size, instead of using --bucket-size.'
+    )
+    parser.add_argument(
+        '--sample-every',
+        type=positive_int,
+        required=False,
+        default=100,
+        help='Sample one record every this many with --balanced-buckets '
+             '[default: 100].'
+    )
+    parser.add_argument(
+        '--overlap-sort',
+        action='store_true',
+        help='Sort the buckets of each input file while the next ones are '
+             'split, and merge them at the end.'
+    )
+    parser.add_argument(
+        '--seal-size',
+        type=utils.parse_size,
+        required=False,
+        default=None,
+        help='With --overlap-sort, also sort the records of a bucket as '
+             'soon as they reach this size, e.g. 256M.'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume an interrupted run in OUTPUT_DIR, with the same '
+             'arguments, from its last checkpoint if any, skipping the '
+             'output files already sorted.'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Add the records of the input files to the sorted output '
+             'already in OUTPUT_DIR, merging them only into the files of '
+             'their buckets.'
+    )
+    parser.add_argument(
+        '--index',
+        action='store_true',
+        help='Write a sparse index next to each output file, to look up '
+             'key ranges with wikiconv-sort.lookup (not with 7z).'
+    )
+    parser.add_argument(
+        '--checkpoint-size',
+        type=utils.parse_size,
+        required=False,
+        default=None,
+        help='Save a checkpoint at the end of each input file and every '
+             'this many bytes of it, e.g. 1G, writing the buckets kept in '
+             'memory to disk, so that --resume does not split it again '
+             '[default: no checkpoints, but with --resume].'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Profile the split and the sort jobs with cProfile, saving '
+             'their statistics in OUTPUT_DIR/profile.'
+    )
+
+    parser.add_argument(
+        '--start-id',
+        type=int,
+        required=False,
+        default=None,
+        help='Sort only the records of the pages with at least this id.'
+    )
+    parser.add_argument(
+        '--end-id',
+        type=int,
+        required=False,
+        default=None,
+        help='Sort only the records of the pages with an id lower than this.'
+    )
+    parser.add_argument(
+        '--namespace',
+        type=int,
+        action='append',
+        required=False,
+        default=None,
+        help='Sort only the records of the pages in this namespace, can be '
+             'repeated.'
+    )
+    parser.add_argument(
+        '--type',
+        action='append',
+        required=False,
+        default=None,
+        help='Sort only the records of this type, e.g. ADDITION, can be '
+             'repeated.'
+    )
+    parser.add_argument(
+        '--since',
+        required=False,
+        default=None,
+        help='Sort only the records from this timestamp, can be truncated, '
+             'e.g. 2007-10.'
+    )
+    parser.add_argument(
+        '--until',
+        required=False,
+        default=None,
+        help='Sort only the records up to this timestamp, included, can be '
+             'truncated.'
+    )
+    parser.add_argument(
+        '--user-id',
+        action='append',
+        required=False,
+        default=None,
+        help='Sort only the records of this user id, can be repeated.'
+    )
+    parser.add_argument(
+        '--user-ids-file',
+        type=pathlib.Path,
+        required=False,
+        default=None,
+        help='Sort only the records of the user ids in this file, one per '
+             'line.'
+    )
 
     parsed_args = parser.parse_args()
+    if parsed_args.index and parsed_args.output_compression not in sparse_index.INDEXED_COMPRESSIONS:
+        parser.error(f"{parsed_args.output_compression} output files can not be indexed")
+    # Parquet files are compressed by pyarrow
+    compressions = [parsed_args.tmp_compression]
+    if parsed_args.output_format != 'parquet':
+        compressions.append(parsed_args.output_compression)
+    for compression in compressions:
+        try:
+            file_utils.check_compression(compression)
+        except ImportError as err:
+            parser.error(str(err))
+    if parsed_args.output_format == 'parquet':
+        if columnar.pyarrow is None:
+            parser.error("pyarrow is needed to write Parquet files")
+        if parsed_args.output_compression not in columnar.PARQUET_COMPRESSIONS:
+            parser.error(f"Parquet files can not be compressed with {parsed_args.output_compression}")
+        if parsed_args.index or parsed_args.incremental:
+            parser.error("Parquet files can not be indexed or added to")
     return parsed_args
 
 
+def get_filter(args) -> filters.RecordFilter:
+    """Return the filter of the records of the command line arguments."""
+    user_ids = None
+    if args.user_id is not None or args.user_ids_file is not None:
+        user_ids = set(args.user_id or ())
+        if args.user_ids_file is not None:
+            with open(args.user_ids_file, encoding='utf-8') as f:
+                user_ids.update(line.strip() for line in f if line.strip())
+    return filters.RecordFilter(
+        start_id=args.start_id,
+        end_id=args.end_id,
+        namespaces=args.namespace,
+        types=args.type,
+        since=args.since,
+        until=args.until,
+        user_ids=user_ids,
+    )
+
+
 def main():
     """Main function."""
     args = get_args()
@@ -59,13 +340,37 @@ def main():
     if not args.output_dir_path.exists():
         args.output_dir_path.mkdir(parents=True)
 
-    sorter.sortFiles(
-        inputFiles=args.files,
-        outputPath=args.output_dir_path,
-        bucketSize=args.bucket_size,
-        compression=args.output_compression,
-        sortBy=args.sort_by
-    )
+    try:
+        sorter.sortFiles(
+            inputFiles=args.files,
+            outputPath=args.output_dir_path,
+            bucketSize=args.bucket_size,
+            compression=args.output_compression,
+            sortBy=args.sort_by,
+            splitWorkers=args.split_workers,
+            memoryLimit=args.memory_limit,
+            tmpDir=args.tmp_dir,
+            inMemoryThreshold=args.in_memory_threshold,
+            maxOpenFiles=args.max_open_files,
+            balancedBuckets=args.balanced_buckets,
+            sampleEvery=args.sample_every,
+            ipBuckets=args.ip_buckets,
+            sortJobs=args.sort_jobs,
+            overlapSort=args.overlap_sort,
+            sealSize=args.seal_size,
+            resume=args.resume,
+            checkpointSize=args.checkpoint_size,
+            incremental=args.incremental,
+            index=args.index,
+            outputFormat=args.output_format,
+            recordFilter=get_filter(args),
+            profile=args.profile,
+            tmpCompression=args.tmp_compression,
+            compressionThreads=args.compression_threads
+        )
+    except (external_sort.SortError, manifest.ManifestError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
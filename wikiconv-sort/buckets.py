@@ -0,0 +1,148 @@
+"""Buckets the records are split into before being sorted."""
+import collections
+import resource
+from typing import List, Optional, Tuple
+
+from . import file_utils
+
+DEFAULT_MAX_OPEN_FILES = 256
+# Records of a spilled bucket buffered before writing them to its file
+WRITE_BUFFER_SIZE = 256 * 1024
+# Compressions whose files can be appended to, the others get a new file
+APPENDABLE_COMPRESSIONS = {None, 'bz2', 'gz', 'lz4', 'zst'}
+
+
+def default_max_open_files() -> int:
+    """Return the number of bucket files kept open by default, a fraction
+    of the limit of open files of the process."""
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return DEFAULT_MAX_OPEN_FILES
+    return max(1, min(DEFAULT_MAX_OPEN_FILES, soft // 4))
+
+
+class WriterPool:
+    """Writers of the spilled buckets, at most `max_open_files` at a time.
+
+    When a bucket needs a writer and the pool is full, the writer of the
+    least recently used bucket is closed. Its file is reopened for
+    appending the next time the bucket is written.
+    """
+
+    def __init__(self, max_open_files: Optional[int] = None):
+        self.max_open_files = max_open_files or default_max_open_files()
+        self._writers = collections.OrderedDict()
+
+    def writer(self, bucket: 'Bucket'):
+        """Return the writer of a bucket, opening it if necessary."""
+        writer = self._writers.get(bucket)
+        if writer is not None:
+            self._writers.move_to_end(bucket)
+            return writer
+
+        while len(self._writers) >= self.max_open_files:
+            _, oldest = self._writers.popitem(last=False)
+            oldest.close()
+        writer = bucket.open()
+        self._writers[bucket] = writer
+        return writer
+
+    def release(self, bucket: 'Bucket') -> None:
+        """Close the writer of a bucket, if it is open."""
+        writer = self._writers.pop(bucket, None)
+        if writer is not None:
+            writer.close()
+
+    def close(self) -> None:
+        """Close all the writers."""
+        while self._writers:
+            _, writer = self._writers.popitem(last=False)
+            writer.close()
+
+
+class Bucket:
+    """Records of a bucket.
+
+    Records are kept in memory until the bucket is spilled, from then on
+    they are buffered and written to the bucket file in large blocks,
+    through the writers of `pool`.
+
+    `size` is the size of the records added since the bucket was last
+    sealed, and `seals` the number of times it was sealed, see `seal`.
+    """
+
+    def __init__(self, filename: str, compression: Optional[str], pool: Optional[WriterPool] = None):
+        self.filename = filename
+        self.compression = compression
+        self.filenames: List[str] = []
+        self.lines: List[bytes] = []
+        self.size = 0
+        self.spilled = False
+        self.seals = 0
+        self._pool = pool if pool is not None else WriterPool()
+        self._buffered = 0
+        self._sealed = 0
+
+    def write_lines(self, lines: List[bytes], size: int) -> None:
+        """Add records, of `size` bytes in all, to the bucket."""
+        self.lines.extend(lines)
+        self.size += size
+        if self.spilled:
+            self._buffered += size
+            if self._buffered >= WRITE_BUFFER_SIZE:
+                self.flush()
+
+    def spill(self) -> None:
+        """Move the records kept in memory to the bucket file."""
+        self.spilled = True
+        self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered records to the bucket file."""
+        if self.lines:
+            self._pool.writer(self).write(b''.join(self.lines))
+            self.lines = []
+            self._buffered = 0
+
+    def open(self):
+        """Open a new writer of the bucket.
+
+        The bucket file is appended to if it was already written since the
+        bucket was sealed, otherwise a new file is added to `filenames`.
+        """
+        if len(self.filenames) > self._sealed and self.compression in APPENDABLE_COMPRESSIONS:
+            return file_utils.output_writer(self.filenames[-1], self.compression, binary=True, append=True)
+
+        filename = self.filename if not self.filenames else f"{self.filename}.{len(self.filenames)}"
+        self.filenames.append(filename)
+        return file_utils.output_writer(filename, self.compression, binary=True)
+
+    def seal(self) -> Tuple[List[str], List[bytes]]:
+        """Return the files, or the lines kept in memory, with the records
+        added since the bucket was last sealed.
+
+        The next records are written to new files, so that the records
+        returned can be sorted while the bucket is still being written.
+        """
+        if self.spilled:
+            self.flush()
+            self._pool.release(self)
+            filenames, lines = self.filenames[self._sealed:], []
+            self._sealed = len(self.filenames)
+        else:
+            filenames, lines = [], self.lines
+            self.lines = []
+        self.size = 0
+        self.seals += 1
+        return filenames, lines
+
+    @property
+    def in_memory(self) -> bool:
+        """Return True if the records of the bucket are kept in memory."""
+        return not self.spilled
+
+    def close(self) -> None:
+        """Write the buffered records and close the bucket file, if any."""
+        if self.spilled:
+            self.flush()
+            self._pool.release(self)
@@ -0,0 +1,105 @@
+"""Parquet output of the sorted records.
+
+Records are converted with `types.cast_json` and written with their
+readable sort key in row groups, whose statistics let readers skip the row
+groups out of a key, page or timestamp range and read only the columns
+they need.
+
+pyarrow is optional, it is needed only to write Parquet files.
+"""
+import functools
+from typing import Callable, Iterable, Optional
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from . import fields
+from . import types
+
+PARQUET_SUFFIX = '.parquet'
+# Size of the records, as JSON, written in each row group
+ROW_GROUP_SIZE = 32 * 1024 ** 2
+# Parquet codecs of the output compressions
+PARQUET_COMPRESSIONS = {
+    None: 'snappy',
+    'gz': 'gzip',
+    'lz4': 'lz4',
+    'zst': 'zstd',
+}
+
+
+def check_available() -> None:
+    """Raise an error if Parquet files can not be written."""
+    if pyarrow is None:
+        raise ImportError("pyarrow is needed to write Parquet files")
+
+
+@functools.lru_cache(maxsize=None)
+def schema() -> 'pyarrow.Schema':
+    """Return the schema of the records returned by `types.cast_json`, after
+    their sort key."""
+    user = pyarrow.struct([
+        ('id', pyarrow.int64()),
+        ('text', pyarrow.string()),
+        ('ip', pyarrow.string()),
+    ])
+    score = pyarrow.struct([
+        (name, pyarrow.float64())
+        for name in ('toxicity', 'severeToxicity', 'profanity', 'threat', 'insult', 'identityAttack')
+    ])
+    return pyarrow.schema([
+        ('sortKey', pyarrow.string()),
+        ('id', pyarrow.string()),
+        ('revId', pyarrow.int64()),
+        ('type', pyarrow.string()),
+        ('conversationId', pyarrow.string()),
+        ('pageTitle', pyarrow.string()),
+        ('content', pyarrow.string()),
+        ('cleanedContent', pyarrow.string()),
+        ('user', user),
+        ('replyToUser', user),
+        ('timestamp', pyarrow.timestamp('s', tz='UTC')),
+        ('pageId', pyarrow.int64()),
+        ('parentId', pyarrow.string()),
+        ('ancestorId', pyarrow.string()),
+        ('authorList', pyarrow.list_(user)),
+        ('comment', pyarrow.string()),
+        ('score', score),
+        ('pageNamespace', pyarrow.int64()),
+    ])
+
+
+def write_lines(
+        path: str,
+        compression: Optional[str],
+        lines: Iterable[bytes],
+        format_key: Callable[[bytes], str]
+    ) -> int:
+    """Write sorted lines, with their binary sort key before the first tab,
+    to a Parquet file and return their number.
+
+    `format_key` returns the readable form of a sort key.
+    """
+    check_available()
+    nlines = 0
+    rows = []
+    size = 0
+    with pyarrow.parquet.ParquetWriter(path, schema(), compression=PARQUET_COMPRESSIONS[compression]) as writer:
+        for line in lines:
+            key, record = line.split(b'\t', 1)
+            row = types.cast_json(fields.loads(record))
+            row['sortKey'] = format_key(key)
+            rows.append(row)
+            size += len(line)
+            if size >= ROW_GROUP_SIZE:
+                writer.write_table(pyarrow.Table.from_pylist(rows, schema=schema()))
+                nlines += len(rows)
+                rows = []
+                size = 0
+        if rows or not nlines:
+            writer.write_table(pyarrow.Table.from_pylist(rows, schema=schema()))
+            nlines += len(rows)
+    return nlines
@@ -0,0 +1,384 @@
+"""External merge sort of files with one record per line.
+
+Lines are compared as bytes, which for UTF-8 text is the same as comparing
+code points and does not depend on the locale. Chunks that fit in the
+memory limit are sorted in memory and spilled to temporary runs, which are
+then merged with a k-way heap merge.
+
+Uncompressed files larger than the memory limit, whose lines are long, are
+not read but mapped in memory, see `MappedFiles`, so that only a compact
+index of their lines is sorted and many more lines fit in each run.
+"""
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import subprocess
+import tempfile
+import zlib
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from . import file_utils
+from . import sparse_index
+
+DEFAULT_MEMORY_LIMIT = 1024 ** 3
+# Approximate memory used by each line kept in a list, besides its content
+LINE_OVERHEAD = 64
+READ_SIZE = 1024 ** 2
+WRITE_LINES = 4096
+# Maximum number of runs merged at the same time
+MERGE_FANIN = 128
+IO_ERRORS = (OSError, EOFError, zlib.error, subprocess.SubprocessError)
+# Position of a line at the end of its index entry: file, start and end
+ENTRY_POSITION = struct.Struct('>HQQ')
+# Approximate memory used by each index entry, besides the key of its line
+ENTRY_OVERHEAD = 48 + ENTRY_POSITION.size
+# Minimum average size of the lines of the files sorted through their map,
+# shorter lines are faster to read and sort than to index
+MAPPED_LINE_SIZE = 1024
+
+
+class SortError(Exception):
+    """Error raised when a file can not be sorted."""
+    pass
+
+
+def read_chunks(
+        paths: Iterable[str],
+        compression: Optional[str],
+        memory_limit: int,
+        lines: Iterable[bytes] = ()
+    ) -> Iterator[List[bytes]]:
+    """Read the lines of the files in chunks that fit in `memory_limit`.
+
+    The first chunk starts with the given `lines`.
+    """
+    chunk = list(lines)
+    size = sum(map(len, chunk)) + LINE_OVERHEAD * len(chunk)
+    for path in paths:
+        with file_utils.input_reader(path, compression, binary=True) as f:
+            while True:
+                lines = f.readlines(READ_SIZE)
+                if not lines:
+                    break
+                if not lines[-1].endswith(b'\n'):
+                    lines[-1] += b'\n'
+                chunk.extend(lines)
+                size += sum(map(len, lines)) + LINE_OVERHEAD * len(lines)
+                if size >= memory_limit:
+                    yield chunk
+                    chunk = []
+                    size = 0
+    yield chunk
+
+
+class MappedFiles:
+    """Uncompressed files mapped in memory, whose lines are sorted through an
+    index instead of being read.
+
+    The index has an entry for each line, with the part of the line up to
+    its first tab and the position of the line. Sorting the entries sorts
+    the lines as bytes, entries with the same key are then ordered by the
+    rest of their lines. Lines are copied from the maps only when they are
+    written.
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        self.maps: List[mmap.mmap] = []
+        try:
+            for path in paths:
+                with open(path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size > 0:
+                        self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except BaseException:
+            self.close()
+            raise
+        # Whether the last line of a file is missing its newline
+        self._unterminated = any(data[-1:] != b'\n' for data in self.maps)
+
+    def sorted_chunks(self, memory_limit: int, size: int = 0) -> Iterator[List[bytes]]:
+        """Yield the sorted index entries of the lines in chunks that fit in
+        `memory_limit`, the first one with `size` already used."""
+        chunk = []
+        pack = ENTRY_POSITION.pack
+        for number, data in enumerate(self.maps):
+            find = data.find
+            end = len(data)
+            start = 0
+            while start < end:
+                stop = find(b'\n', start)
+                stop = end if stop < 0 else stop + 1
+                tab = find(b'\t', start, stop)
+                key = data[start:stop if tab < 0 else tab + 1]
+                chunk.append(key + pack(number, start, stop))
+                size += len(key) + ENTRY_OVERHEAD
+                start = stop
+                if size >= memory_limit:
+                    yield self._sort(chunk)
+                    chunk = []
+                    size = 0
+        yield self._sort(chunk)
+
+    def _sort(self, entries: List[bytes]) -> List[bytes]:
+        entries.sort()
+        # Entries with the same key are ordered by the rest of their lines
+        key_end = -ENTRY_POSITION.size
+        first = 0
+        first_key = entries[0][:key_end] if entries else None
+        for i in range(1, len(entries) + 1):
+            key = entries[i][:key_end] if i < len(entries) else None
+            if key != first_key:
+                if i - first > 1:
+                    entries[first:i] = sorted(entries[first:i], key=self._line)
+                first = i
+                first_key = key
+        return entries
+
+    def _line(self, entry: bytes) -> bytes:
+        number, start, stop = ENTRY_POSITION.unpack_from(entry, len(entry) - ENTRY_POSITION.size)
+        return self.maps[number][start:stop]
+
+    def lines(self, entries: List[bytes]) -> Iterator[bytes]:
+        """Yield the lines of the index entries."""
+        maps = self.maps
+        for i in range(0, len(entries), WRITE_LINES):
+            positions = b''.join([entry[-ENTRY_POSITION.size:] for entry in entries[i:i + WRITE_LINES]])
+            lines = [maps[number][start:stop] for number, start, stop in ENTRY_POSITION.iter_unpack(positions)]
+            if self._unterminated:
+                lines = [line if line.endswith(b'\n') else line + b'\n' for line in lines]
+            yield from lines
+
+    def close(self) -> None:
+        """Unmap the files."""
+        for data in self.maps:
+            data.close()
+        self.maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def sorted_chunks(
+        paths: List[str],
+        compression: Optional[str],
+        memory_limit: int,
+        lines: Iterable[bytes] = (),
+        mapped: Optional[MappedFiles] = None
+    ) -> Iterator[Iterable[bytes]]:
+    """Yield the lines of the files, and the given `lines`, in sorted chunks
+    that fit in `memory_limit`.
+
+    If given, the `mapped` files are sorted through their index instead of
+    being read, and the lines of their chunks are copied from the maps as
+    they are iterated.
+    """
+    if mapped is None:
+        for chunk in read_chunks(paths, compression, memory_limit, lines):
+            chunk.sort()
+            yield chunk
+        return
+    lines = sorted(lines)
+    size = sum(map(len, lines)) + LINE_OVERHEAD * len(lines)
+    for entries in mapped.sorted_chunks(memory_limit, size):
+        yield heapq.merge(lines, mapped.lines(entries)) if lines else mapped.lines(entries)
+        lines = []
+
+
+def average_line_size(paths: List[str]) -> float:
+    """Return the average size of the lines at the start of uncompressed
+    files."""
+    size = 0
+    nlines = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read(READ_SIZE)
+        size += len(data)
+        nlines += data.count(b'\n')
+    return size / max(nlines, 1)
+
+
+def map_files(paths: List[str], compression: Optional[str], memory_limit: int) -> Optional[MappedFiles]:
+    """Return the files mapped in memory if they are uncompressed, can not
+    be sorted in memory and their lines are at least `MAPPED_LINE_SIZE`
+    long on average, otherwise None."""
+    if compression is not None or sum(map(os.path.getsize, paths)) <= memory_limit:
+        return None
+    if average_line_size(paths) < MAPPED_LINE_SIZE:
+        return None
+    return MappedFiles(paths)
+
+
+def write_lines(f, lines: Iterable[bytes]) -> int:
+    """Write the lines to a binary file in large blocks, return their number."""
+    nlines = 0
+    lines = iter(lines)
+    while True:
+        block = list(itertools.islice(lines, WRITE_LINES))
+        if not block:
+            break
+        f.write(b''.join(block))
+        nlines += len(block)
+    return nlines
+
+
+def spill(lines: Iterable[bytes], tmp_dir: Optional[str]) -> str:
+    """Write sorted lines to a temporary run and return its path."""
+    fd, path = tempfile.mkstemp(prefix='wikiconv-sort-', suffix='.run', dir=tmp_dir)
+    try:
+        with open(fd, 'wb') as f:
+            write_lines(f, lines)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def open_run(path: str, compression: Optional[str] = None):
+    """Open a sorted run, compressed with `compression`, to read its lines."""
+    if compression is None:
+        return open(path, 'rb', buffering=READ_SIZE)
+    return file_utils.input_reader(path, compression, binary=True)
+
+
+def merge_files(paths: List[str], tmp_dir: Optional[str], compression: Optional[str] = None) -> str:
+    """Merge sorted files, compressed with `compression`, into a temporary
+    run and return its path."""
+    files = []
+    try:
+        for path in paths:
+            files.append(open_run(path, compression))
+        return spill(heapq.merge(*files), tmp_dir)
+    finally:
+        for f in files:
+            f.close()
+
+
+def merge_runs(runs: List[str], tmp_dir: Optional[str]) -> List[str]:
+    """Merge the runs until they are at most `MERGE_FANIN`."""
+    while len(runs) > MERGE_FANIN:
+        group = runs[:MERGE_FANIN]
+        del runs[:MERGE_FANIN]
+        try:
+            runs.append(merge_files(group, tmp_dir))
+        finally:
+            for run in group:
+                os.remove(run)
+    return runs
+
+
+def sort_files(
+        input_paths: List[str],
+        output_path: str,
+        compression: Optional[str],
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        tmp_dir: Optional[str] = None,
+        lines: Iterable[bytes] = (),
+        format_line: Optional[Callable[[bytes], bytes]] = None,
+        runs: Iterable[str] = (),
+        sorted_lines: Iterable[Iterable[bytes]] = (),
+        index: bool = False,
+        write_output: Optional[Callable[[Iterator[bytes]], int]] = None,
+        input_compression: Optional[str] = None,
+        input_runs: Iterable[str] = ()
+    ) -> int:
+    """Sort the lines of the input files, the given `lines` and the lines of
+    the sorted `runs` and `input_runs` into a single output file.
+
+    The input files and `input_runs` are compressed with
+    `input_compression` and the output file with `compression`. Paths are
+    given without the extension of their compression, as in
+    `file_utils.output_writer`. Sorted runs, e.g. written by `sort_run`, are
+    merged without sorting them again, and they are not removed, as are the
+    iterables of `sorted_lines`. If given,
+    `format_line` is applied to each sorted line before writing it. With
+    `index` the output file is indexed by the part of the lines before the
+    first tab, see `sparse_index`. If given, `write_output` writes the
+    sorted lines instead, as they are, to the output file. Return the
+    number of lines written.
+    """
+    sorted_runs = list(runs)
+    input_runs = list(input_runs)
+    runs = []
+    files = []
+    mapped = None
+    try:
+        try:
+            mapped = map_files(input_paths, input_compression, memory_limit)
+            chunks = sorted_chunks(input_paths, input_compression, memory_limit, lines, mapped)
+            chunk = next(chunks)
+            for next_chunk in chunks:
+                runs.append(spill(chunk, tmp_dir))
+                chunk = next_chunk
+        except IO_ERRORS as err:
+            raise SortError(f"Can not sort {', '.join(input_paths)}: {err}") from err
+
+        if len(runs) + len(sorted_runs) + len(input_runs) > MERGE_FANIN:
+            # Merge the sorted runs into temporary ones, removed with the others
+            for i in range(0, len(sorted_runs), MERGE_FANIN):
+                runs.append(merge_files(sorted_runs[i:i + MERGE_FANIN], tmp_dir))
+            for i in range(0, len(input_runs), MERGE_FANIN):
+                runs.append(merge_files(input_runs[i:i + MERGE_FANIN], tmp_dir, input_compression))
+            sorted_runs = []
+            input_runs = []
+        runs = merge_runs(runs, tmp_dir)
+        for run in runs + sorted_runs:
+            files.append(open_run(run))
+        for run in input_runs:
+            files.append(open_run(run, input_compression))
+        sorted_lines = list(sorted_lines)
+        lines = heapq.merge(*files, *sorted_lines, chunk) if files or sorted_lines else chunk
+
+        try:
+            if write_output is not None:
+                return write_output(lines)
+            if index:
+                with sparse_index.IndexedWriter(output_path, compression) as f:
+                    return f.write_lines(lines, format_line)
+            if format_line is not None:
+                lines = map(format_line, lines)
+            with file_utils.output_writer(output_path, compression, binary=True) as f:
+                return write_lines(f, lines)
+        except IO_ERRORS as err:
+            raise SortError(f"Can not write {output_path}: {err}") from err
+    finally:
+        for f in files:
+            f.close()
+        if mapped is not None:
+            mapped.close()
+        for run in runs:
+            os.remove(run)
+
+
+def sort_run(
+        input_paths: List[str],
+        compression: Optional[str],
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        tmp_dir: Optional[str] = None,
+        lines: Iterable[bytes] = ()
+    ) -> str:
+    """Sort the lines of the input files, and the given `lines`, into a
+    temporary run and return its path."""
+    runs = []
+    try:
+        try:
+            mapped = map_files(input_paths, compression, memory_limit)
+            try:
+                for chunk in sorted_chunks(input_paths, compression, memory_limit, lines, mapped):
+                    runs.append(spill(chunk, tmp_dir))
+            finally:
+                if mapped is not None:
+                    mapped.close()
+        except IO_ERRORS as err:
+            raise SortError(f"Can not sort {', '.join(input_paths)}: {err}") from err
+
+        runs = merge_runs(runs, tmp_dir)
+        if len(runs) == 1:
+            return runs.pop()
+        return merge_files(runs, tmp_dir)
+    finally:
+        for run in runs:
+            os.remove(run)
@@ -0,0 +1,67 @@
+"""Extraction of the fields used to sort the records from raw JSON lines.
+
+The sort fields are pulled from the raw line with regular expressions, so
+that the record never needs to be fully decoded and re-encoded. When a
+field can not be extracted the whole line is decoded instead.
+
+If orjson is installed decoding the whole line is faster than extracting
+the fields, so it is used for every line.
+"""
+import json
+import re
+from typing import Mapping
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+loads = orjson.loads if orjson is not None else json.loads
+
+# A JSON string, which may contain braces
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+
+# Each field name appears once in a record: the other "id"s are the ones of
+# the users, without dots.
+STRING_FIELDS = {
+    'id': re.compile(rb'"id"\s*:\s*"(\d+\.\d+\.\d+)"'),
+    'timestamp': re.compile(rb'"timestamp"\s*:\s*"([^"\\]*)"'),
+    'pageId': re.compile(rb'"pageId"\s*:\s*"(\d+)"'),
+}
+USER_FIELDS = {
+    field: (re.compile(name + rb'\s*:\s*(\{(?:[^{}"]+|' + _STRING + rb')*\}|' + _STRING + rb'|null)'), name)
+    for field, name in (('user', b'"user"'), ('replyToUser', b'"replyToUser"'))
+}
+USER_KEYS = re.compile(rb'"(id|ip)"\s*:\s*"([^"\\]*)"')
+
+
+def extract_fields(line: bytes) -> Mapping:
+    """Return the sort fields of a record, decoding the whole record only if
+    they can not be extracted from the raw line.
+
+    Only the "id" and "ip" keys of the users are extracted.
+    """
+    obj = {}
+    for field, pattern in STRING_FIELDS.items():
+        match = pattern.search(line)
+        if match is None:
+            return loads(line)
+        obj[field] = match.group(1).decode('utf-8')
+
+    for field, (pattern, name) in USER_FIELDS.items():
+        match = pattern.search(line)
+        if match is not None:
+            value = match.group(1)
+            if value[:1] == b'{':
+                obj[field] = {key.decode('ascii'): value.decode('utf-8') for key, value in USER_KEYS.findall(value)}
+            elif value[:1] == b'"':
+                obj[field] = loads(value)
+            else:
+                obj[field] = None
+        elif name in line:
+            return loads(line)
+
+    return obj
+
+
+extract = loads if orjson is not None else extract_fields
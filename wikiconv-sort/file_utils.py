@@ -1,15 +1,79 @@
 """Main module that parses command line arguments."""
 import io
+import os
 import json
 import bz2
 import gzip
+import lzma
+import mmap
+import queue
+import re
+import functools
+import threading
+import time
 import subprocess
+import collections
+import concurrent.futures
 
 import pathlib
-from typing import IO, Optional, Union
+from typing import IO, Callable, Iterator, List, Optional, Union
 
 import compressed_stream as cs
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Size of the blocks compressed independently by `BlockWriter`
+COMPRESSION_BLOCK_SIZE = 1024 ** 2
+# Blocks of each `BlockWriter` being compressed at the same time
+MAX_PENDING_BLOCKS = 4
+COMPRESSION_THREADS = os.cpu_count() or 1
+# Size of the blocks read ahead by `BackgroundReader`, and their number
+DECOMPRESSION_BLOCK_SIZE = 4 * 1024 ** 2
+MAX_READ_AHEAD_BLOCKS = 8
+DECOMPRESSION_THREADS = os.cpu_count() or 1
+# Start of a bz2 stream: magic, block size and magic of the first block
+BZ2_STREAM_START = re.compile(rb'BZh[1-9]\x31\x41\x59\x26\x53\x59')
+BZ2_STREAM_START_SIZE = len(b'BZh9\x31\x41\x59\x26\x53\x59')
+# Size of the groups of bz2 streams decompressed together
+BZ2_GROUP_SIZE = 1024 ** 2
+
+ZSTD_LEVEL = 3
+
+
+def zstd_compress(data: bytes) -> bytes:
+    """Compress data as a zstd frame, compressors are not thread-safe."""
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def lz4_compress(data: bytes) -> bytes:
+    """Compress data as a lz4 frame."""
+    return lz4.frame.compress(data)
+
+
+BLOCK_COMPRESSORS = {
+    'bz2': functools.partial(bz2.compress, compresslevel=9),
+    'gz': functools.partial(gzip.compress, compresslevel=6, mtime=0),
+    'lz4': lz4_compress,
+    'zst': zstd_compress,
+}
+# Name and module, if installed, of the packages of the optional compressions
+OPTIONAL_COMPRESSIONS = {
+    'lz4': ('lz4', lz4),
+    'zst': ('zstandard', zstandard),
+}
+
+_compression_executor = None
+# Time spent compressing blocks in this process, in all its threads
+_compression_seconds = 0.0
+_compression_lock = threading.Lock()
+
 
 def open_csv_file(path: Union[str, IO]):
     """Open a csv file, decompressing it if necessary."""
@@ -29,7 +93,347 @@ def open_jsonobjects_file(path: Union[str, IO]) -> list:
     return (json.loads(line) for line in f)
 
 
-def compressor_7z(file_path: str):
+def check_process(process: subprocess.Popen):
+    """Wait for a process and raise an error if it failed."""
+    returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process.args)
+
+
+class ProcessWriter(io.BufferedWriter):
+    """File-object writing to the stdin of a process.
+
+    Closing it waits for the process and raises an error if it failed.
+    """
+
+    def __init__(self, process: subprocess.Popen):
+        super().__init__(process.stdin.raw)
+        self.process = process
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        check_process(self.process)
+
+
+class ProcessReader(io.BufferedReader):
+    """File-object reading from the stdout of a process.
+
+    Closing it waits for the process and raises an error if it failed.
+    """
+
+    def __init__(self, process: subprocess.Popen):
+        super().__init__(process.stdout.raw)
+        self.process = process
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        check_process(self.process)
+
+
+def compression_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the threads compressing the blocks of every `BlockWriter`."""
+    global _compression_executor
+    if _compression_executor is None:
+        _compression_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=COMPRESSION_THREADS,
+            thread_name_prefix='compression',
+        )
+    return _compression_executor
+
+
+def set_compression_threads(threads: int) -> None:
+    """Set the number of threads compressing the blocks of the writers."""
+    global COMPRESSION_THREADS, _compression_executor
+    COMPRESSION_THREADS = threads
+    if _compression_executor is not None:
+        _compression_executor.shutdown(wait=True)
+        _compression_executor = None
+
+
+def _reset_compression_executor():
+    # The threads of the parent are not running in a forked child
+    global _compression_executor, _compression_seconds, _compression_lock
+    _compression_executor = None
+    _compression_seconds = 0.0
+    _compression_lock = threading.Lock()
+
+
+def _compress_block(compress: Callable[[bytes], bytes], block: bytes) -> bytes:
+    global _compression_seconds
+    start = time.perf_counter()
+    data = compress(block)
+    with _compression_lock:
+        _compression_seconds += time.perf_counter() - start
+    return data
+
+
+def compression_seconds() -> float:
+    """Return the time spent by this process compressing the blocks of
+    every `BlockWriter`, added up over the compression threads."""
+    with _compression_lock:
+        return _compression_seconds
+
+
+os.register_at_fork(after_in_child=_reset_compression_executor)
+
+
+class BlockWriter(io.BufferedIOBase):
+    """File-object compressing the data written in independent blocks.
+
+    Blocks are compressed by background threads, zlib and bz2 release the
+    GIL while compressing, and written to the file in order. The file is a
+    sequence of gzip members, or bz2 streams, which gzip and bz2 read as a
+    single stream.
+
+    At most `MAX_PENDING_BLOCKS` blocks are compressed at the same time,
+    writing more waits for the oldest one. `offsets` are the offsets in the
+    file of the blocks written so far, `blocks` the number of blocks
+    submitted.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            compression: str,
+            block_size: int = COMPRESSION_BLOCK_SIZE,
+            append: bool = False
+        ):
+        super().__init__()
+        self.compress = BLOCK_COMPRESSORS[compression]
+        self.block_size = block_size
+        self._file = open(path, 'ab' if append else 'wb')
+        self._offset = self._file.tell()
+        self._buffer = []
+        self._size = 0
+        self._pending = collections.deque()
+        self._empty = True
+        self.offsets: List[int] = []
+        self.blocks = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.block_size:
+            self._submit()
+        return len(data)
+
+    def end_block(self) -> None:
+        """Compress the data written since the last block as a block, so
+        that the next data starts a new one."""
+        if self._buffer:
+            self._submit()
+
+    def _submit(self):
+        block = b''.join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self._empty = False
+        self.blocks += 1
+        self._pending.append(compression_executor().submit(_compress_block, self.compress, block))
+        while self._pending and (len(self._pending) > MAX_PENDING_BLOCKS or self._pending[0].done()):
+            self._write_block()
+
+    def _write_block(self):
+        data = self._pending.popleft().result()
+        self._file.write(data)
+        self.offsets.append(self._offset)
+        self._offset += len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # An empty file is still a valid compressed stream
+            if self._buffer or self._empty:
+                self._submit()
+            while self._pending:
+                self._write_block()
+        finally:
+            self._file.close()
+            super().close()
+
+
+class BackgroundReader(io.RawIOBase):
+    """File-object reading blocks of data in a background thread.
+
+    The blocks are queued, at most `max_blocks` ahead of the reader, so that
+    decompressing them, which releases the GIL, overlaps with processing
+    the data already read. `close` is called when the reader is closed.
+    """
+
+    def __init__(
+            self,
+            blocks: Iterator[bytes],
+            close: Optional[Callable[[], None]] = None,
+            max_blocks: int = MAX_READ_AHEAD_BLOCKS
+        ):
+        super().__init__()
+        self._blocks = blocks
+        self._close = close
+        self._queue = queue.Queue(max_blocks)
+        self._stopped = threading.Event()
+        self._data = memoryview(b'')
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, name='decompression', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for block in self._blocks:
+                if block and not self._put(block):
+                    return
+            self._put(b'')
+        except BaseException as err:
+            self._put(err)
+
+    def _put(self, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._data and not self._eof:
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            self._eof = not item
+            self._data = memoryview(item)
+        n = min(len(b), len(self._data))
+        b[:n] = self._data[:n]
+        self._data = self._data[n:]
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        self._stopped.set()
+        self._thread.join()
+        try:
+            if self._close is not None:
+                self._close()
+        finally:
+            super().close()
+
+
+def read_blocks(f: IO[bytes], block_size: int = DECOMPRESSION_BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield the data of a file in blocks."""
+    return iter(functools.partial(f.read, block_size), b'')
+
+
+def bz2_stream_blocks(data: mmap.mmap, start: int) -> Iterator[bytes]:
+    """Yield the data of the bz2 stream at `start` as it is decompressed,
+    then its end offset."""
+    decompressor = bz2.BZ2Decompressor()
+    offset = start
+    while not decompressor.eof:
+        chunk = b''
+        if decompressor.needs_input:
+            chunk = data[offset:offset + BZ2_GROUP_SIZE]
+            if not chunk:
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+            offset += len(chunk)
+        yield decompressor.decompress(chunk, DECOMPRESSION_BLOCK_SIZE)
+    return offset - len(decompressor.unused_data)
+
+
+def parallel_bz2_blocks(path: str, threads: int = DECOMPRESSION_THREADS) -> Iterator[bytes]:
+    """Yield the data of a bz2 file, decompressing groups of its streams in
+    parallel threads.
+
+    Files written by parallel compressors, or by `BlockWriter`, are
+    sequences of independent streams, found as the file is read. Streams
+    larger than a group, as in files with a single stream, are decompressed
+    as they are read instead.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix='decompression') as executor:
+            pending = collections.deque()
+            start = 0
+            while start < size:
+                limit = start + BZ2_GROUP_SIZE
+                end = size if size <= limit else start
+                while end < size:
+                    # Streams starting in the group
+                    match = BZ2_STREAM_START.search(data, end + 1, min(size, limit + BZ2_STREAM_START_SIZE))
+                    if match is None:
+                        break
+                    end = match.start()
+                if end > start:
+                    pending.append(executor.submit(lambda start=start, end=end: bz2.decompress(data[start:end])))
+                    if len(pending) > 2 * threads:
+                        yield pending.popleft().result()
+                    start = end
+                    continue
+                while pending:
+                    yield pending.popleft().result()
+                start = yield from bz2_stream_blocks(data, start)
+            while pending:
+                yield pending.popleft().result()
+
+
+def open_jsonlines_file(path: str) -> IO[bytes]:
+    """Open a file of JSON objects, one per line, for reading the raw lines,
+    decompressing it if necessary.
+
+    Files are decompressed in a background thread, and bz2 files with
+    several streams by several threads.
+    """
+    suffix = pathlib.Path(path).suffix
+    if suffix == '.7z':
+        return decompressor_7z(path, binary=True)
+    elif suffix == '.bz2':
+        return io.BufferedReader(BackgroundReader(parallel_bz2_blocks(path)), DECOMPRESSION_BLOCK_SIZE)
+    elif suffix == '.gz':
+        f = gzip.open(path, 'rb')
+    elif suffix in ('.lzma', '.xz'):
+        f = lzma.open(path, 'rb')
+    elif suffix == '.zst':
+        f = input_reader(path[:-len(suffix)], 'zst', binary=True)
+    elif suffix == '.lz4':
+        f = input_reader(path[:-len(suffix)], 'lz4', binary=True)
+    else:
+        return open(path, 'rb')
+    return io.BufferedReader(BackgroundReader(read_blocks(f), f.close), DECOMPRESSION_BLOCK_SIZE)
+
+
+def skip(f: IO[bytes], offset: int) -> None:
+    """Move a file opened with `open_jsonlines_file` to an offset of its
+    decompressed data, reading and discarding it if the file is not
+    seekable."""
+    if f.seekable():
+        f.seek(offset)
+        return
+    while offset > 0:
+        data = f.read(min(offset, COMPRESSION_BLOCK_SIZE))
+        if not data:
+            break
+        offset -= len(data)
+
+
+def compressor_7z(file_path: str, binary: bool = False):
     """"Return a file-object that compresses data written using 7z."""
     p = subprocess.Popen(
         ['7z', 'a', '-si', file_path],
@@ -37,19 +441,82 @@ def compressor_7z(file_path: str):
         stderr=subprocess.DEVNULL,
         stdout=subprocess.DEVNULL,
     )
-    return io.TextIOWrapper(p.stdin, encoding='utf-8')
+    f = ProcessWriter(p)
+    if binary:
+        return f
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+
+def decompressor_7z(file_path: str, binary: bool = False):
+    """"Return a file-object that reads data decompressed using 7z."""
+    p = subprocess.Popen(
+        ['7z', 'e', '-so', file_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    f = ProcessReader(p)
+    if binary:
+        return f
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+
+def check_compression(compression: Optional[str]) -> None:
+    """Raise an error if files can not be compressed with `compression`."""
+    name, module = OPTIONAL_COMPRESSIONS.get(compression, (None, True))
+    if module is None:
+        raise ImportError(f"{name} is needed to compress files with {compression}")
+
+
+def zstd_reader(f: IO[bytes]) -> IO[bytes]:
+    """Return a file-object reading the zstd frames of a file."""
+    reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True)
+    return io.BufferedReader(reader, DECOMPRESSION_BLOCK_SIZE)
+
+
+def compressed_path(path: str, compression: Optional[str]) -> str:
+    """Return the path of a file written by `output_writer`."""
+    return f"{path}.{compression}" if compression else path
+
+
+def output_writer(path: str, compression: Optional[str], binary: bool = False, append: bool = False):
+    """Write data to a compressed file.
+
+    gz, bz2, zst and lz4 files are compressed in the background by a
+    `BlockWriter`.
+    With `append` the data is added at the end of the file, which is not
+    supported by 7z.
+    """
+    mode = ('a' if append else 'w') + ('b' if binary else 't')
+    if compression == '7z':
+        if append:
+            raise ValueError("Can not append to a 7z file")
+        return compressor_7z(path + '.7z', binary=binary)
+    elif compression in BLOCK_COMPRESSORS:
+        f = BlockWriter(f"{path}.{compression}", compression, append=append)
+        if binary:
+            return f
+        return io.TextIOWrapper(f, encoding='utf-8')
+    else:
+        return open(path, mode, encoding=None if binary else 'utf-8')
 
 
-def output_writer(path: str, compression: Optional[str]):
-    """Write data to a compressed file."""
+def input_reader(path: str, compression: Optional[str], binary: bool = False):
+    """Read data from a file written by `output_writer`."""
+    mode = 'rb' if binary else 'rt'
+    encoding = None if binary else 'utf-8'
     if compression == '7z':
-        return compressor_7z(path + '.7z')
+        return decompressor_7z(path + '.7z', binary=binary)
     elif compression == 'bz2':
-        return bz2.open(path + '.bz2', 'wt', encoding='utf-8')
+        return bz2.open(path + '.bz2', mode, encoding=encoding)
     elif compression == 'gz':
-        return gzip.open(path + '.gz', 'wt', encoding='utf-8')
+        return gzip.open(path + '.gz', mode, encoding=encoding)
+    elif compression == 'zst':
+        f = zstd_reader(open(path + '.zst', 'rb'))
+        return f if binary else io.TextIOWrapper(f, encoding=encoding)
+    elif compression == 'lz4':
+        return lz4.frame.open(path + '.lz4', mode, encoding=encoding)
     else:
-        return open(path, 'wt', encoding='utf-8')
+        return open(path, mode, encoding=encoding)
 
 
 def create_path(path: Union[pathlib.Path, str]):
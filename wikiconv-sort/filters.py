@@ -0,0 +1,122 @@
+"""Filters of the records applied while splitting the input files.
+
+The fields checked by a filter are pulled from the raw line, as in
+`fields`, so that the records dropped are never decoded. Each field is
+found by its name and matched only there, which is cheaper than searching
+the whole line. When a field can not be found this way the whole line is
+decoded instead.
+"""
+import re
+from typing import Any, Dict, Iterable, Optional
+
+from . import fields
+
+# Pattern of a field, which must match where its name is found, and
+# whether the name is searched from the end of the line
+FIELD_PATTERNS = {
+    'pageId': (re.compile(rb'"pageId"\s*:\s*"(\d+)"'), False),
+    'pageNamespace': (re.compile(rb'"pageNamespace"\s*:\s*(-?\d+)'), True),
+    'type': (re.compile(rb'"type"\s*:\s*"([^"\\]*)"'), False),
+    'timestamp': (re.compile(rb'"timestamp"\s*:\s*"([^"\\]*)"'), False),
+    'user': (fields.USER_FIELDS['user'][0], False),
+}
+
+
+class RecordFilter:
+    """Filter of the records by page id range, from `start_id` included to
+    `end_id` excluded, page namespace, type, timestamp, from `since` to
+    `until` included, which can be truncated, e.g. 2007-10, and user id.
+
+    Calling it with a raw line returns True if the record is kept. Only the
+    criteria given are checked.
+    """
+
+    def __init__(
+            self,
+            start_id: Optional[int] = None,
+            end_id: Optional[int] = None,
+            namespaces: Optional[Iterable[int]] = None,
+            types: Optional[Iterable[str]] = None,
+            since: Optional[str] = None,
+            until: Optional[str] = None,
+            user_ids: Optional[Iterable[str]] = None
+        ):
+        self.start_id = start_id
+        self.end_id = end_id
+        self.namespaces = None if namespaces is None else frozenset(namespaces)
+        self.types = None if types is None else frozenset(types)
+        self.since = since
+        self.until = until
+        self.user_ids = None if user_ids is None else frozenset(user_ids)
+
+    def settings(self) -> Dict[str, Any]:
+        """Return the criteria of the filter, which can be saved as JSON."""
+        return {
+            'startId': self.start_id,
+            'endId': self.end_id,
+            'namespaces': None if self.namespaces is None else sorted(self.namespaces),
+            'types': None if self.types is None else sorted(self.types),
+            'since': self.since,
+            'until': self.until,
+            'userIds': None if self.user_ids is None else sorted(self.user_ids),
+        }
+
+    def __bool__(self) -> bool:
+        return any(value is not None for value in self.settings().values())
+
+    def __call__(self, line: bytes) -> bool:
+        record = None
+
+        def field(name: str) -> Any:
+            # The raw field, or the decoded one if it can not be found
+            nonlocal record
+            pattern, from_end = FIELD_PATTERNS[name]
+            key = b'"' + name.encode('ascii') + b'"'
+            position = line.rfind(key) if from_end else line.find(key)
+            match = pattern.match(line, position) if position >= 0 else None
+            if match is not None:
+                return match.group(1)
+            if record is None:
+                record = fields.loads(line)
+            value = record.get(name)
+            return value.encode('utf-8') if isinstance(value, str) else value
+
+        if self.start_id is not None or self.end_id is not None:
+            page_id = field('pageId')
+            if page_id is None:
+                return False
+            page_id = int(page_id)
+            if self.start_id is not None and page_id < self.start_id:
+                return False
+            if self.end_id is not None and page_id >= self.end_id:
+                return False
+
+        if self.namespaces is not None:
+            namespace = field('pageNamespace')
+            if namespace is None or int(namespace) not in self.namespaces:
+                return False
+
+        if self.types is not None:
+            record_type = field('type')
+            if record_type is None or record_type.decode('utf-8') not in self.types:
+                return False
+
+        if self.since is not None or self.until is not None:
+            timestamp = field('timestamp')
+            if timestamp is None:
+                return False
+            timestamp = timestamp.decode('utf-8')
+            if self.since is not None and timestamp[:len(self.since)] < self.since:
+                return False
+            if self.until is not None and timestamp[:len(self.until)] > self.until:
+                return False
+
+        if self.user_ids is not None:
+            user = field('user')
+            if isinstance(user, bytes):
+                user = dict((key.decode('ascii'), value.decode('utf-8')) for key, value in fields.USER_KEYS.findall(user))
+            if not user or user.get('id') not in self.user_ids:
+                return False
+
+        return True
+
@@ -0,0 +1,45 @@
+"""Compact binary sort keys.
+
+Numeric fields are zero-padded to a fixed width and packed two decimal
+digits per byte, so that comparing keys as bytes compares their fields in
+order. Packed bytes are shifted past the control characters: a key never
+contains tabs or newlines, so it can prefix a record in a file with one
+record per line.
+"""
+import binascii
+
+_BCD = bytes(16 * hi + lo for hi in range(10) for lo in range(10))
+_SHIFTED = bytes(range(0x20, 0x20 + 100))
+_PACK = bytes.maketrans(_BCD, _SHIFTED)
+_UNPACK = bytes.maketrans(_SHIFTED, _BCD)
+
+
+def is_digits(text: str) -> bool:
+    """Return True if `text` is made only of ASCII decimal digits, the ones
+    that `pack_digits` packs."""
+    return text.isascii() and text.isdigit()
+
+
+def pack_digits(digits: str) -> bytes:
+    """Pack a string with an even number of decimal digits.
+
+    The digits are not checked, see `is_digits`: hex letters would be
+    packed into control characters.
+    """
+    return binascii.unhexlify(digits).translate(_PACK)
+
+
+def unpack_digits(packed: bytes) -> str:
+    """Unpack the digits packed by `pack_digits`."""
+    return binascii.hexlify(packed.translate(_UNPACK)).decode('ascii')
+
+
+def timestamp_digits(timestamp: str) -> str:
+    """Return the digits of an ISO 8601 UTC timestamp, e.g. 20071031115456
+    for 2007-10-31T11:54:56Z."""
+    return timestamp[:19].replace('-', '').replace('T', '').replace(':', '')
+
+
+def digits_timestamp(digits: str) -> str:
+    """Return the timestamp of the digits returned by `timestamp_digits`."""
+    return f"{digits[:4]}-{digits[4:6]}-{digits[6:8]}T{digits[8:10]}:{digits[10:12]}:{digits[12:14]}Z"
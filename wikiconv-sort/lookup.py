@@ -0,0 +1,134 @@
+"""Lookup of the records of a key range in indexed sorted output files.
+
+    python -m wikiconv-sort.lookup OUTPUT_DIR --key 12345 --since 2007-10 --until 2008
+"""
+import argparse
+import functools
+import pathlib
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import manifest
+from . import sorter
+from . import sparse_index
+
+# Greater than any byte of a sort key
+KEY_END = b'\xff'
+
+
+def read_finished(output_path: pathlib.Path, sort_by: Optional[str] = None) -> Tuple[dict, str]:
+    """Return the manifest of a finished run and its sorting field, which
+    can be omitted if the run was sorted by a single field."""
+    data = manifest.read(output_path)
+    if data.get('buckets') is None:
+        raise manifest.ManifestError(f"The run in {output_path} has not finished")
+    sort_bys = data['sortBy']
+    if sort_by is None and len(sort_bys) == 1:
+        sort_by = sort_bys[0]
+    if sort_by not in sort_bys:
+        raise ValueError(f"The run in {output_path} was sorted by {', '.join(sort_bys)}")
+    return data, sort_by
+
+
+class Lookup:
+    """Lookup of the records in the sorted output files of a run, which must
+    have been sorted with `index`, by `sort_by`, which can be omitted if the
+    run was sorted by a single field.
+
+    The indexes of the output files are read once, when they are first
+    needed.
+    """
+
+    def __init__(self, output_path: pathlib.Path, sort_by: Optional[str] = None):
+        self.output_path = pathlib.Path(output_path)
+        self.manifest, self.sort_by = read_finished(self.output_path, sort_by)
+        self._line_key = functools.partial(sorter.sortedLineKey, sortBy=self.sort_by)
+        self._indexes: Dict[str, List[Tuple[bytes, int]]] = {}
+
+    def key_range(
+            self,
+            key: Optional[str] = None,
+            since: Optional[str] = None,
+            until: Optional[str] = None
+        ) -> Tuple[bytes, bytes]:
+        """Return the first and the last sort key of the records of a page id,
+        or of a user id or IP address, from `since` to `until` included."""
+        start = sorter.sortKeyPrefix(self.sort_by, key, since)
+        end = sorter.sortKeyPrefix(self.sort_by, key, until) + KEY_END
+        return start, end
+
+    def records(
+            self,
+            key: Optional[str] = None,
+            since: Optional[str] = None,
+            until: Optional[str] = None
+        ) -> Iterator[bytes]:
+        """Yield the sorted lines of the records of a key range, see
+        `key_range`."""
+        start, end = self.key_range(key, since, until)
+        for bucket in self.manifest['buckets']:
+            if bucket['sortBy'] != self.sort_by:
+                continue
+            path = str(self.output_path / bucket['filename'])
+            entries = self._indexes.get(path)
+            if entries is None:
+                entries = self._indexes[path] = sparse_index.read_index(path)
+            yield from sparse_index.read_range(path, start, end, self._line_key, entries)
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='wikiconv-lookup',
+        description='Print the records of a key range of indexed sorted files.',
+    )
+    parser.add_argument(
+        'output_dir_path',
+        metavar='OUTPUT_DIR',
+        type=pathlib.Path,
+        help='Output directory of a run sorted with --index.',
+    )
+    parser.add_argument(
+        '--sort-by',
+        choices={'user', 'page', 'replyToUser', 'date'},
+        required=False,
+        default=None,
+        help='Sorting field of the files, if the run was sorted by several.'
+    )
+    parser.add_argument(
+        '--key',
+        required=False,
+        default=None,
+        help='Page id, or user id or IP address, of the records.'
+    )
+    parser.add_argument(
+        '--since',
+        required=False,
+        default=None,
+        help='First timestamp of the records, can be truncated, e.g. 2007-10, '
+             'needs --key unless the files are sorted by date.'
+    )
+    parser.add_argument(
+        '--until',
+        required=False,
+        default=None,
+        help='Last timestamp of the records, included, can be truncated, '
+             'needs --key unless the files are sorted by date.'
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = get_args()
+    try:
+        lookup = Lookup(args.output_dir_path, args.sort_by)
+        for line in lookup.records(args.key, args.since, args.until):
+            sys.stdout.buffer.write(line)
+    except (OSError, ValueError, manifest.ManifestError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
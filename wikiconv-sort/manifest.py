@@ -0,0 +1,227 @@
+"""Manifest of the files produced by a run."""
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+MANIFEST_FILENAME = 'manifest.json'
+# Seconds between two saves of the sorted outputs in place, which are
+# sorted again if the run is interrupted before they are saved
+SORTED_SAVE_INTERVAL = 10
+
+
+def _umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Mode of the files created by open(), read once since the umask can only be
+# read by changing it
+FILE_MODE = 0o666 & ~_umask()
+
+
+def manifest_path(output_path: Path) -> Path:
+    """Return the path of the manifest of an output directory."""
+    return Path(output_path) / MANIFEST_FILENAME
+
+
+def write_atomic(path: Path, data: dict) -> None:
+    """Write a JSON file, replacing it only once it is completely written."""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=str(path.parent))
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            # mkstemp creates the file readable only by its owner
+            os.fchmod(f.fileno(), FILE_MODE)
+            json.dump(data, f, separators=(',', ':'))
+            f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write(output_path: Path, manifest: dict) -> None:
+    """Write the manifest of an output directory."""
+    write_atomic(manifest_path(output_path), manifest)
+
+
+def read(output_path: Path) -> dict:
+    """Read the manifest of an output directory."""
+    with open(str(manifest_path(output_path)), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def bucket_key(bucket: Tuple[str, int]) -> str:
+    """Return the key in the manifest of a bucket, its sort field and
+    number."""
+    sort_by, number = bucket
+    return f"{sort_by}/{number}"
+
+
+def parse_bucket_key(key: str) -> Tuple[str, int]:
+    """Return the sort field and the number of a bucket key."""
+    sort_by, _, number = key.rpartition('/')
+    return sort_by, int(number)
+
+
+class ManifestError(Exception):
+    """Error raised when a run can not be resumed from its manifest."""
+    pass
+
+
+class RunState:
+    """State of a run, saved in the manifest of the output directory at every
+    checkpoint so that an interrupted run can be resumed.
+
+    The manifest records the settings of the run, how much of each input
+    file has been split, the files and runs of each bucket written up to
+    the last checkpoint and the sorted output files. Buckets are given by
+    their sort field and number.
+    """
+
+    def __init__(self, output_path: Path, settings: dict, resume: bool = False):
+        self.output_path = Path(output_path)
+        self._lock = threading.RLock()
+        self._saved = time.monotonic()
+        self._unsaved = False
+
+        if resume and manifest_path(self.output_path).exists():
+            data = read(self.output_path)
+            for key, value in settings.items():
+                if data.get(key) != value:
+                    raise ManifestError(f"Can not resume the run in {self.output_path}: "
+                                        f"{key} was {data.get(key)!r}, not {value!r}")
+            if 'split' not in data:
+                raise ManifestError(f"Can not resume the run in {self.output_path}: no checkpoint in the manifest")
+            data['session'] += 1
+            self.data = data
+        else:
+            self.data = dict(settings, session=0, boundaries=None, split={}, parts={}, sorted={}, buckets=None)
+        self.data.setdefault('base', {})
+        self.save()
+
+    @property
+    def session(self) -> int:
+        """Number of times the run has been resumed."""
+        return self.data['session']
+
+    def save(self) -> None:
+        """Write the manifest."""
+        with self._lock:
+            write(self.output_path, self.data)
+            self._saved = time.monotonic()
+            self._unsaved = False
+
+    def flush(self) -> None:
+        """Write the manifest if it has changes not yet saved."""
+        with self._lock:
+            if self._unsaved:
+                self.save()
+
+    def split_offset(self, input_path: str) -> Optional[int]:
+        """Return the offset in the decompressed input file up to which it has
+        been split, or None if the input file has been split completely."""
+        split = self.data['split'].get(input_path, {'offset': 0, 'done': False})
+        return None if split['done'] else split['offset']
+
+    def add_inputs(self, input_paths: Iterable[str]) -> None:
+        """Add input files to a finished run, whose sorted outputs become the
+        base the records of the new input files are merged into.
+
+        Input files already in the run are ignored, so that adding the same
+        files again resumes an interrupted addition.
+        """
+        with self._lock:
+            inputs = self.data.setdefault('inputs', [])
+            new_inputs = [path for path in input_paths if path not in inputs]
+            if not new_inputs:
+                return
+            if self.data['buckets'] is None and inputs:
+                raise ManifestError(f"Can not add input files to the run in {self.output_path}: "
+                                    f"it has not finished, resume it first")
+            if self.data['buckets'] is not None:
+                self.data['base'] = self.data['sorted']
+                self.data['sorted'] = {}
+                self.data['parts'] = {}
+                self.data['buckets'] = None
+            inputs.extend(new_inputs)
+            self.save()
+
+    def base_output(self, bucket: Tuple[str, int]) -> Optional[dict]:
+        """Return the sorted output of a bucket that the new records are
+        merged into, or None if the bucket had no records."""
+        output = self.data['base'].get(bucket_key(bucket))
+        if output is None:
+            return None
+        path = self.output_path / output['filename']
+        if not path.exists() or path.stat().st_size != output['size']:
+            raise ManifestError(f"Can not add records to {path}: it was changed after it was sorted")
+        return output
+
+    def finish(self) -> None:
+        """Record the sorted outputs of all the buckets, the ones of the base
+        without new records included, and forget the files of the buckets,
+        which are removed."""
+        with self._lock:
+            self.data['parts'] = {}
+            for bucket, output in self.data['base'].items():
+                self.data['sorted'].setdefault(bucket, output)
+            self.data['buckets'] = [
+                dict(sortBy=sort_by, bucket=number, filename=output['filename'], records=output['records'])
+                for (sort_by, number), output in sorted(
+                    (parse_bucket_key(key), output) for key, output in self.data['sorted'].items()
+                )
+            ]
+            self.save()
+
+    def bucket_parts(self) -> Dict[Tuple[str, int], dict]:
+        """Return the files, runs and size of the buckets."""
+        return {parse_bucket_key(key): parts for key, parts in self.data['parts'].items()}
+
+    def checkpoint(self, input_path: str, offset: int, done: bool, parts: Iterable[tuple]) -> None:
+        """Record that an input file has been split up to `offset` and the
+        parts of buckets, (bucket, files, runs, size), sealed since its last
+        checkpoint."""
+        with self._lock:
+            for bucket, files, runs, size in parts:
+                bucket_parts = self.data['parts'].setdefault(bucket_key(bucket), {'files': [], 'runs': [], 'size': 0})
+                bucket_parts['files'].extend(files)
+                bucket_parts['runs'].extend(runs)
+                bucket_parts['size'] += size
+            self.data['split'][input_path] = {'offset': offset, 'done': done}
+            self.save()
+
+    def sorted_records(self, bucket: Tuple[str, int]) -> Optional[int]:
+        """Return the number of records of the sorted output of a bucket, or
+        None if it is missing or it does not have the size recorded."""
+        output = self.data['sorted'].get(bucket_key(bucket))
+        if output is None:
+            return None
+        path = self.output_path / output['filename']
+        if not path.exists() or path.stat().st_size != output['size']:
+            return None
+        return output['records']
+
+    def set_sorted(self, bucket: Tuple[str, int], filename: str, records: int, size: Optional[int] = None) -> None:
+        """Record the sorted output of a bucket, of the given size if it is
+        not yet in place.
+
+        Outputs not yet in place are saved at once, the others at most every
+        `SORTED_SAVE_INTERVAL` seconds, see `flush`.
+        """
+        with self._lock:
+            in_place = size is None
+            if in_place:
+                size = (self.output_path / filename).stat().st_size
+            self.data['sorted'][bucket_key(bucket)] = {'filename': filename, 'records': records, 'size': size}
+            if not in_place or time.monotonic() - self._saved >= SORTED_SAVE_INTERVAL:
+                self.save()
+            else:
+                self._unsaved = True
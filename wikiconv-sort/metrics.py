@@ -0,0 +1,89 @@
+"""Metrics of a run, written as JSON lines.
+
+Every event is a JSON object on its own line of the metrics file in the
+output directory, with the kind of event, its time and the process that
+emitted it. The processes of a run append their events to the file on
+their own, each event with a single write.
+
+With profiling, the split of the input files and the sort jobs are run
+under cProfile and their statistics saved in the profile directory, to be
+read with `pstats`.
+"""
+import cProfile
+import collections
+import contextlib
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator
+
+METRICS_FILENAME = 'metrics.jsonl'
+PROFILE_DIRNAME = 'profile'
+
+# Descriptors of the metrics files open in this process, by path
+_files: Dict[str, int] = {}
+
+
+def _reset_files():
+    # The file descriptors are shared with the parent after a fork
+    _files.clear()
+
+
+os.register_at_fork(after_in_child=_reset_files)
+
+
+def emit(output_path: Path, event: str, **values: Any) -> None:
+    """Append an event with its values to the metrics file of a run."""
+    path = str(Path(output_path) / METRICS_FILENAME)
+    fd = _files.get(path)
+    if fd is None:
+        fd = _files[path] = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    record = {
+        'time': datetime.now().astimezone().isoformat(timespec='milliseconds'),
+        'event': event,
+        'pid': os.getpid(),
+        **values,
+    }
+    os.write(fd, json.dumps(record).encode('utf-8') + b'\n')
+
+
+class Timers:
+    """Time spent in each stage of a loop, added up over its iterations."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = collections.defaultdict(float)
+
+    @contextlib.contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Add the time spent in the block to a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - start
+
+    def values(self) -> Dict[str, float]:
+        """Return the seconds of each stage, as metric values."""
+        return {f"{stage}Seconds": round(seconds, 3) for stage, seconds in self.seconds.items()}
+
+
+@contextlib.contextmanager
+def profiled(output_path: Path, name: str) -> Iterator[None]:
+    """Profile the block and save its statistics as `name`.prof."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_path = Path(output_path) / PROFILE_DIRNAME
+        profile_path.mkdir(exist_ok=True)
+        profiler.dump_stats(str(profile_path / f"{name}.prof"))
+
+
+def profile_call(output_path: Path, name: str, fn: Callable, *args, **kwargs) -> Any:
+    """Call a function under `profiled`, also in another process."""
+    with profiled(output_path, name):
+        return fn(*args, **kwargs)
@@ -0,0 +1,152 @@
+"""Scheduler of the sort jobs."""
+import concurrent.futures
+import functools
+import heapq
+import itertools
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+from . import external_sort
+from . import file_utils
+
+# Memory limit of each job, however small the total budget is
+MIN_JOB_MEMORY = 16 * 1024 ** 2
+
+
+def default_jobs() -> int:
+    """Return the number of jobs run at the same time by default."""
+    return os.cpu_count() or 1
+
+
+class Scheduler:
+    """Run jobs in a pool of processes, at most `jobs` at the same time.
+
+    Jobs are started as soon as a process is free, the waiting ones from
+    the largest, so that the longest jobs do not start last. Jobs can be
+    submitted while others are running. The `memory_limit` is the budget
+    of all the jobs together, each job should use at most
+    `job_memory_limit`.
+
+    Each job compresses its files with `compression_threads` threads, by
+    default with its share of the processors.
+
+    The result of every job is checked: when a job fails the jobs not yet
+    started are cancelled, and `submit` and `wait` raise a `SortError`.
+    """
+
+    def __init__(
+            self,
+            jobs: Optional[int] = None,
+            memory_limit: int = external_sort.DEFAULT_MEMORY_LIMIT,
+            compression_threads: Optional[int] = None
+        ):
+        self.jobs = max(1, jobs or default_jobs())
+        self.job_memory_limit = max(MIN_JOB_MEMORY, memory_limit // self.jobs)
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.jobs,
+            initializer=file_utils.set_compression_threads,
+            initargs=(compression_threads or max(1, default_jobs() // self.jobs),),
+        )
+        # Jobs finish on the thread of the executor
+        self._condition = threading.Condition(threading.RLock())
+        self._counter = itertools.count()
+        self._pending = []
+        self._running = 0
+        # Callbacks of finished jobs being called
+        self._callbacks = 0
+        # Futures of the jobs submitted to the executor and not yet done
+        self._futures: Set[concurrent.futures.Future] = set()
+        self._error = None
+        self.results: Dict[Hashable, Any] = {}
+
+    def submit(
+            self,
+            name: Hashable,
+            size: int,
+            fn: Callable,
+            *args,
+            callback: Optional[Callable[[Any], None]] = None
+        ) -> None:
+        """Add a job of the given size, its result is saved as `name`.
+
+        If given, `callback` is called with the result when the job is done.
+        """
+        with self._condition:
+            self._check()
+            heapq.heappush(self._pending, (-size, next(self._counter), name, fn, args, callback))
+            self._start()
+
+    def _start(self) -> None:
+        while self._pending and self._running < self.jobs:
+            _, _, name, fn, args, callback = heapq.heappop(self._pending)
+            self._running += 1
+            future = self._executor.submit(fn, *args)
+            self._futures.add(future)
+            future.add_done_callback(functools.partial(self._done, name, callback))
+
+    def _done(self, name: Hashable, callback: Optional[Callable], future: concurrent.futures.Future) -> None:
+        with self._condition:
+            self._running -= 1
+            self._futures.discard(future)
+            if future.cancelled():
+                self._condition.notify_all()
+                return
+            # Not raised here, its traceback would keep the thread of the
+            # executor alive, which Python 3.8 then fails to wake up at exit
+            error = future.exception()
+            if error is None:
+                self.results[name] = future.result()
+                self._callbacks += 1
+            else:
+                self._fail(name, error)
+            self._start()
+            self._condition.notify_all()
+        if error is not None:
+            return
+
+        # Out of the lock, so that `submit` and `wait` are not blocked by it
+        try:
+            if callback is not None:
+                callback(self.results[name])
+        except BaseException as err:
+            # Without its traceback, for the same reason
+            error = err.with_traceback(None)
+        with self._condition:
+            self._callbacks -= 1
+            if error is not None:
+                self._fail(name, error)
+            self._condition.notify_all()
+
+    def _fail(self, name: Hashable, error: BaseException) -> None:
+        if self._error is None:
+            self._error = external_sort.SortError(f"Sort job {name} failed: {error}")
+            self._error.__cause__ = error
+        self._pending = []
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def wait(self) -> Dict[Hashable, Any]:
+        """Wait for all the jobs and return their results by name."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._error is not None or not (self._pending or self._running or self._callbacks))
+            self._check()
+            return self.results
+
+    def close(self) -> None:
+        """Stop the pool of processes, cancelling the jobs not yet started."""
+        with self._condition:
+            self._pending = []
+            futures = list(self._futures)
+        # Jobs queued in the executor but not yet running
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
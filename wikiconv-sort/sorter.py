@@ -1,36 +1,106 @@
-import os
-import json
+import bisect
+import collections
+import contextlib
+import functools
+import itertools
 import math
-from datetime import datetime
+import multiprocessing
+import os
+import queue
+import socket
+import time
 import concurrent.futures
 
 from pathlib import Path
-from typing import Iterable, Mapping
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Union
 
+from . import buckets
+from . import columnar
+from . import external_sort
+from . import fields
 from . import file_utils
+from . import filters
+from . import keys
+from . import manifest
+from . import metrics
+from . import scheduler
+from . import sparse_index
 from . import utils
 
-EXTENSIONS = {
-    'gz': ["zcat"],
-    'bz2': ["bzcat"],
-    '7z': ["7z", "e", "-so"],
-    'lzma': ["lzcat"]
-}
-NPRINTREVISION = 10000
+# Seconds between the progress events of the split of an input file
+PROGRESS_INTERVAL = 60
+# Size of the lines of the input files split together
+SPLIT_BATCH_SIZE = 4 * 1024 ** 2
+DEFAULT_SAMPLE_EVERY = 100
+DEFAULT_IN_MEMORY_THRESHOLD = 64 * 1024 ** 2
+# Start of the names of the bucket files, removed at the end of the run
+BUCKET_FILE_PREFIX = 'tosort-wikiconv-sort-'
+
+# Kinds of user in the user sort keys, in sort order
+USER_NONE = b'0'
+USER_IPV4 = b'1'
+USER_IPV6 = b'2'
+USER_ID = b'3'
+# Prefix of the IPv6 addresses in the readable user sort keys
+IPV6_STRING_PREFIX = 'ipv6:'
+# Digits of the user ids in the user sort keys
+USER_ID_WIDTH = 12
+
+# Length of the packed timestamp at the start of the date sort keys
+DATE_KEY_LENGTH = 7
+
+# Sort field and bucket number of a bucket
+BucketId = Tuple[str, int]
 
 def getBucketNumberByDate(obj: Mapping, bucketSize: int) -> int:
     year = int(obj['timestamp'][:4])
     month = int(obj['timestamp'][5:7])
     return ((year - 2000) * 12) + (month - 1)
 
-def comparatorStringByDate(obj: Mapping) -> str:
-    timestamp = obj['timestamp']
-    year = int(timestamp[:4])
-    month = int(timestamp[5:7])
-    id = obj['id']
-    return f"{year * 100 + month} {timestamp} {id}"
+def sortKeyByDate(obj: Mapping) -> bytes:
+    timestamp = keys.timestamp_digits(obj['timestamp'])
+    return keys.pack_digits(timestamp) + obj['id'].encode('utf-8')
+
+def sortKeyStringByDate(key: bytes) -> str:
+    timestamp = keys.digits_timestamp(keys.unpack_digits(key[:DATE_KEY_LENGTH]))
+    id = key[DATE_KEY_LENGTH:].decode('utf-8')
+    return f"{timestamp[:4]}{timestamp[5:7]} {timestamp} {id}"
+
+def isIpv4(ip: str) -> bool:
+    """Return True if `ip` is an IPv4 address, four decimal octets."""
+    octets = ip.split('.')
+    return len(octets) == 4 and all(keys.is_digits(octet) and len(octet) <= 3 and int(octet) <= 255 for octet in octets)
+
+def ipv6Digits(ip: str) -> Optional[str]:
+    """Return the 32 hex digits of an IPv6 address, or None if it is not
+    valid, e.g. with a zone."""
+    try:
+        return socket.inet_pton(socket.AF_INET6, ip).hex()
+    except (OSError, ValueError):
+        return None
+
+def isUserId(userId: str) -> bool:
+    """Return True if `userId` fits the user ids of the user sort keys."""
+    return keys.is_digits(userId) and len(userId) <= USER_ID_WIDTH
+
+def getBucketNumberByIp(ip: str, ipBuckets: int = 1) -> int:
+    """Return the bucket of an IP address among the first `ipBuckets`.
+
+    IPv4 addresses are split in ranges of the same size among the first
+    `ipBuckets` - 1 buckets, IPv6 addresses, which sort after them, are
+    in the last one. Addresses that are not valid are in the first one,
+    their sort key sorts before the others.
+    """
+    if ipBuckets == 1:
+        return 1
+    if ':' in ip:
+        return ipBuckets if ipv6Digits(ip) is not None else 1
+    if not isIpv4(ip):
+        return 1
+    address = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    return 1 + ((address * (ipBuckets - 1)) >> 32)
 
-def getBucketNumberByUsername(obj: Mapping, bucketSize: int, userField: str = 'user') -> int:
+def getBucketNumberByUsername(obj: Mapping, bucketSize: int, userField: str = 'user', ipBuckets: int = 1) -> int:
     if userField not in obj:
         return 0
     
@@ -41,144 +111,822 @@ def getBucketNumberByUsername(obj: Mapping, bucketSize: int, userField: str = 'u
     if user is None:
         return 0
     elif 'ip' in user:
-        return 1
+        return getBucketNumberByIp(user['ip'], ipBuckets)
     elif 'id' in user:
-        return math.floor(int(obj[userField]['id']) / bucketSize) + 2
+        if not isUserId(user['id']):
+            # With the records of the addresses that are not valid
+            return 1
+        return math.floor(int(user['id']) / bucketSize) + 1 + ipBuckets
     else:
         return 0
 
-def comparatorStringByUsername(obj: Mapping, userField: str = 'user') -> str:
+def sortKeyByUsername(obj: Mapping, userField: str = 'user') -> bytes:
     idSegments = obj['id'].split('.')
-    par0 = "000000000"
-
-    if userField in obj:
-        user = obj[userField]
-        if 'ip' in user:
-            par0 = "".join([x.zfill(3) for x in obj[userField]['ip'].split(".")])
-        elif 'id' in user:
-            par0 = obj[userField]['id'].zfill(12)
-
-    par1 = obj['timestamp']
-    par2 = idSegments[1].zfill(8)
-    par3 = idSegments[2].zfill(8)
-    
-    return f"{par0} {par1} {par2} {par3}"
+    par123 = keys.timestamp_digits(obj['timestamp']) + idSegments[1].zfill(8) + idSegments[2].zfill(8)
+
+    user = obj.get(userField)
+    if user is not None and 'ip' in user:
+        ip = user['ip']
+        if ':' in ip:
+            par0 = ipv6Digits(ip)
+            if par0 is not None:
+                return USER_IPV6 + par0.encode('ascii') + keys.pack_digits(par123)
+        elif isIpv4(ip):
+            par0 = "".join([x.zfill(3) for x in ip.split(".")])
+            return USER_IPV4 + keys.pack_digits(par0 + par123)
+    elif user is not None and 'id' in user and isUserId(user['id']):
+        return USER_ID + keys.pack_digits(user['id'].zfill(USER_ID_WIDTH) + par123)
+
+    # No user, or an address or id that is not valid
+    return USER_NONE + keys.pack_digits(par123)
+
+def sortKeyStringByUsername(key: bytes) -> str:
+    kind = key[:1]
+    if kind == USER_IPV6:
+        # Fixed width, after the digits of the IPv4 addresses as in the keys
+        par0 = IPV6_STRING_PREFIX + key[1:33].decode('ascii')
+        digits = keys.unpack_digits(key[33:])
+    elif kind == USER_NONE:
+        par0 = "000000000"
+        digits = keys.unpack_digits(key[1:])
+    else:
+        digits = keys.unpack_digits(key[1:])
+        par0, digits = digits[:USER_ID_WIDTH], digits[USER_ID_WIDTH:]
+
+    return f"{par0} {keys.digits_timestamp(digits[:14])} {digits[14:22]} {digits[22:30]}"
 
 def getBucketNumberByPage(obj: Mapping, bucketSize: int) -> int:
     return math.floor(int(obj['pageId']) / bucketSize)
 
-def comparatorStringByPage(obj: Mapping) -> str:
+def sortKeyByPage(obj: Mapping) -> bytes:
     idSegments = obj['id'].split('.')
+    return keys.pack_digits(
+        obj['pageId'].zfill(10)
+        + keys.timestamp_digits(obj['timestamp'])
+        + idSegments[1].zfill(8)
+        + idSegments[2].zfill(8)
+    )
+
+def sortKeyStringByPage(key: bytes) -> str:
+    digits = keys.unpack_digits(key)
+    par0 = str(int(digits[:10])).zfill(9)
+    return f"{par0} {keys.digits_timestamp(digits[10:24])} {digits[24:32]} {digits[32:40]}"
+
+SORT_KEYS = {
+    'date': sortKeyByDate,
+    'page': sortKeyByPage,
+    'user': sortKeyByUsername,
+    'replyToUser': lambda obj: sortKeyByUsername(obj, 'replyToUser')
+}
 
-    par0 = obj['pageId'].zfill(9)
-    par1 = obj['timestamp']
-    par2 = idSegments[1].zfill(8)
-    par3 = idSegments[2].zfill(8)
-    
-    return f"{par0} {par1} {par2} {par3}"
-
-COMPARATORS = {
-    'date': comparatorStringByDate,
-    'page': comparatorStringByPage,
-    'user': comparatorStringByUsername,
-    'replyToUser': lambda obj: comparatorStringByUsername(obj, 'replyToUser')
+SORT_KEY_STRINGS = {
+    'date': sortKeyStringByDate,
+    'page': sortKeyStringByPage,
+    'user': sortKeyStringByUsername,
+    'replyToUser': sortKeyStringByUsername
 }
 
 BUCKET_NUMBER = {
     'date': getBucketNumberByDate,
     'page': getBucketNumberByPage,
     'user': getBucketNumberByUsername,
-    'replyToUser': lambda obj, bucketSize: getBucketNumberByUsername(obj, bucketSize, 'replyToUser')
+    'replyToUser': lambda obj, bucketSize, ipBuckets=1: getBucketNumberByUsername(obj, bucketSize, 'replyToUser', ipBuckets)
 }
 
-def fileIndex(i: int, sortBy: str) -> str:
-    if sortBy == 'date':
+# Sort fields whose bucket numbers depend on the number of IP buckets
+USER_SORTS = {'user', 'replyToUser'}
+# Start of the balanced user buckets of the user ids, whose readable keys
+# would sort before the ones of the addresses in the same bucket
+USER_BUCKET_STARTS = [USER_ID]
+
+def formatSortedLine(line: bytes, sortBy: str) -> bytes:
+    """Replace the binary sort key of a line with its readable form."""
+    key, record = line.split(b'\t', 1)
+    return SORT_KEY_STRINGS[sortBy](key).encode('utf-8') + b'\t' + record
+
+def parseSortedLine(line: bytes, sortBy: str) -> bytes:
+    """Replace the readable sort key of a line with its binary form, the
+    inverse of `formatSortedLine`."""
+    _, record = line.split(b'\t', 1)
+    return SORT_KEYS[sortBy](fields.extract(record)) + b'\t' + record
+
+def sortedLineKey(line: bytes, sortBy: str) -> bytes:
+    """Return the binary sort key of a line of a sorted file."""
+    _, record = line.split(b'\t', 1)
+    return SORT_KEYS[sortBy](fields.extract(record))
+
+def sortKeyPrefix(sortBy: str, value: Optional[str] = None, timestamp: Optional[str] = None) -> bytes:
+    """Return the start of the sort keys of the records of a page id, or of
+    a user id or IP address, when sorting by page or by user, from the
+    given timestamp, which can be truncated, e.g. 2007-10.
+
+    When sorting by page or by user a timestamp needs a `value`, since the
+    keys do not start with it.
+    """
+    if timestamp is not None and value is None and sortBy != 'date':
+        raise ValueError(f"Records sorted by {sortBy} can be looked up by timestamp only with a key")
+    prefix = b''
+    if sortBy == 'page' and value is not None and keys.is_digits(value) and len(value) <= 10:
+        prefix = keys.pack_digits(value.zfill(10))
+    elif sortBy in USER_SORTS and value is not None and ':' in value and ipv6Digits(value) is not None:
+        prefix = USER_IPV6 + ipv6Digits(value).encode('ascii')
+    elif sortBy in USER_SORTS and value is not None and isIpv4(value):
+        prefix = USER_IPV4 + keys.pack_digits("".join([x.zfill(3) for x in value.split(".")]))
+    elif sortBy in USER_SORTS and value is not None and isUserId(value):
+        prefix = USER_ID + keys.pack_digits(value.zfill(USER_ID_WIDTH))
+    elif value is not None:
+        raise ValueError(f"Records sorted by {sortBy} can not be looked up by {value}")
+    if timestamp is not None:
+        digits = keys.timestamp_digits(timestamp)
+        if len(digits) % 2 or not keys.is_digits(digits):
+            raise ValueError(f"Records can not be looked up from timestamp {timestamp}")
+        prefix += keys.pack_digits(digits)
+    return prefix
+
+def fileIndex(i: int, sortBy: str, balanced: bool = False) -> str:
+    if sortBy == 'date' and not balanced:
         return f"{str(i//12 + 2000).zfill(4)}{str(i%12+1).zfill(2)}"
     else:
         return str(i).zfill(4)
 
-def sortFiles(
+def sortFields(sortBy: Union[str, Iterable[str]]) -> List[str]:
+    """Return the list of the fields of `sortBy`, a field or several."""
+    return [sortBy] if isinstance(sortBy, str) else list(sortBy)
+
+def sampleFile(
+        inputFile: Path,
+        bucketSize: int,
+        sortBy: Union[str, List[str]],
+        sampleEvery: int,
+        recordFilter: Optional[filters.RecordFilter] = None
+    ) -> Dict[str, List[Tuple[bytes, int]]]:
+    """Return the sort key and the size of every `sampleEvery`-th record of
+    a file, for each field of `sortBy`, skipping the records that are not
+    sorted or that `recordFilter` drops."""
+    sortBys = sortFields(sortBy)
+
+    samples = {field: [] for field in sortBys}
+    with file_utils.open_jsonlines_file(str(inputFile)) as dump:
+        lines = dump if recordFilter is None else filter(recordFilter, dump)
+        for line in itertools.islice(lines, 0, None, sampleEvery):
+            obj = fields.extract(line)
+            for field in sortBys:
+                if BUCKET_NUMBER[field](obj, bucketSize) > 0:
+                    key = SORT_KEYS[field](obj)
+                    samples[field].append((key, len(key) + len(line) + 1))
+    return samples
+
+def computeBoundaries(samples: List[Tuple[bytes, int]], nbuckets: int, starts: Iterable[bytes] = ()) -> List[bytes]:
+    """Return the sort keys splitting the samples in `nbuckets` of about the
+    same size in bytes, and the keys in `starts`, which always start a
+    bucket.
+
+    Bucket i, from 1, gets the keys between boundaries i-2 and i-1.
+    """
+    samples = sorted(samples)
+    totalSize = sum(size for _, size in samples)
+    boundaries = []
+    cumulativeSize = 0
+    for key, size in samples:
+        if cumulativeSize >= totalSize * (len(boundaries) + 1) / nbuckets:
+            if not boundaries or key > boundaries[-1]:
+                boundaries.append(key)
+            if len(boundaries) == nbuckets - 1:
+                break
+        cumulativeSize += size
+    return sorted(set(boundaries).union(starts))
+
+def sealBucket(
+        bucketId: BucketId,
+        bucket: buckets.Bucket,
+        onSeal: Callable[[BucketId, List[str], List[str], int], None]
+    ) -> None:
+    """Seal a bucket and pass its files, the runs with its lines kept in
+    memory and their size to `onSeal`.
+
+    Lines kept in memory are sorted and written to a run next to the bucket
+    file, compressed as the bucket files, so that they are not lost if the
+    run is interrupted.
+    """
+    size = bucket.size
+    filenames, lines = bucket.seal()
+    runs = []
+    if lines:
+        lines.sort()
+        run = f"{bucket.filename}.{bucket.seals}.run"
+        with file_utils.output_writer(run, bucket.compression, binary=True) as f:
+            external_sort.write_lines(f, lines)
+        runs.append(run)
+    onSeal(bucketId, filenames, runs, size)
+
+def removeBucketFiles(outputPath: Path) -> None:
+    """Remove the bucket files and runs of a finished run, also the ones
+    left by its interrupted sessions."""
+    for path in Path(outputPath).glob(f"{BUCKET_FILE_PREFIX}*"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+def putEvent(eventQueue: queue.Queue, *event) -> None:
+    """Put an event of a splitter on a queue, see `splitFiles`."""
+    eventQueue.put(event)
+
+def splitFiles(
         inputFiles: Iterable[Path],
         outputPath: Path,
         bucketSize: int,
         compression: str,
-        sortBy: str
-    ) -> None:
-
-    printTimestamp(outputPath, "Starting")
-
-    # outputFilesNames = [str(outputPath / (f"bucket-{str(i).zfill(4)}.json")) for i in range(math.ceil(nrOfPages / bucketSize))]
-    # outputFiles = [file_utils.output_writer(path=filename, compression=compression) for filename in outputFilesNames]
-    outputFilesNames = []
-    outputFiles = []
-
-    getBucketNumber = BUCKET_NUMBER[sortBy]
-    comparatorString = COMPARATORS[sortBy]
-
+        sortBy: Union[str, List[str]],
+        shard: Optional[int] = None,
+        inMemoryThreshold: int = DEFAULT_IN_MEMORY_THRESHOLD,
+        memoryLimit: int = external_sort.DEFAULT_MEMORY_LIMIT,
+        maxOpenFiles: Optional[int] = None,
+        boundaries: Optional[Mapping[str, List[bytes]]] = None,
+        ipBuckets: int = 1,
+        onSeal: Optional[Callable[[BucketId, List[str], List[str], int], None]] = None,
+        sealSize: Optional[int] = None,
+        onCheckpoint: Optional[Callable[[str, int, bool], None]] = None,
+        checkpointSize: Optional[int] = None,
+        offsets: Optional[Mapping[str, int]] = None,
+        session: int = 0,
+        recordFilter: Optional[filters.RecordFilter] = None,
+        keepInMemory: bool = False
+    ) -> Dict[BucketId, buckets.Bucket]:
+    """Split the input files into buckets and return them by sort field and
+    bucket number.
+
+    When `sortBy` is a list of fields, each record is put in a bucket of
+    every field, so that the input files are read once for all of them.
+    Buckets are created when their first record is found, so that there
+    are no empty buckets.
+
+    Buckets are kept in memory as long as they are smaller than
+    `inMemoryThreshold` and all together fit in `memoryLimit`, the others
+    are spilled to their bucket file.
+
+    When `shard` is given the bucket files get a per-shard suffix, so that
+    several splitters can run at the same time on disjoint input files,
+    and files written by a resumed run a per-`session` one.
+    At most `maxOpenFiles` bucket files are open at the same time.
+
+    If `boundaries` of a field are given, records are put in the bucket of
+    their sort key range, see `computeBoundaries`, instead of the bucket of
+    `BUCKET_NUMBER`. When sorting by user, anonymous records are split in
+    `ipBuckets` buckets by address range, see `getBucketNumberByIp`.
+
+    If `onSeal` is given, every bucket is sealed at each checkpoint, at the
+    end of each input file and every `checkpointSize` bytes of it, after
+    which `onCheckpoint` is called with the input file, the offset reached
+    in it and whether it is done. A bucket is also sealed when the records
+    written since it was last sealed reach `sealSize`, so that they can be
+    sorted while the split goes on. See `sealBucket`. With `keepInMemory`
+    the buckets kept in memory are not sealed, their lines are returned
+    with them to be sorted without writing them, so the checkpoints can not
+    be resumed from.
+
+    Lines are read and split in batches of `SPLIT_BATCH_SIZE` bytes, whose
+    records are added to each bucket together, and checkpoints are taken
+    at the end of a batch.
+
+    Input files are split from their offset in `offsets`, if any. Records
+    dropped by `recordFilter`, which checks the raw lines, are skipped
+    before they are decoded.
+    """
+
+    outputBuckets = {}
+    writerPool = buckets.WriterPool(maxOpenFiles)
+    memorySize = 0
+
+    sorts = []
+    for field in sortFields(sortBy):
+        getBucketNumber = BUCKET_NUMBER[field]
+        if field in USER_SORTS:
+            getBucketNumber = functools.partial(getBucketNumber, ipBuckets=ipBuckets)
+        sorts.append((field, getBucketNumber, SORT_KEYS[field], None if boundaries is None else boundaries.get(field)))
+    shardSuffix = ('' if not session else f".s{session}") + ('' if shard is None else f".w{shard}")
+
+    def checkpoint(inputFile: Path, offset: int, done: bool) -> None:
+        nonlocal memorySize
+        for bucketId, bucket in outputBuckets.items():
+            if bucket.size > 0 and not (keepInMemory and bucket.in_memory):
+                sealBucket(bucketId, bucket, onSeal)
+        if not keepInMemory:
+            memorySize = 0
+        if onCheckpoint is not None:
+            onCheckpoint(str(inputFile), offset, done)
 
     # Split dump
     for inputFile in inputFiles:
         utils.log(f"Analyzing {inputFile}...")
 
         nobjs = 0
-        dump = file_utils.open_jsonobjects_file(str(inputFile))
-
-        #process line
-        for obj in dump:
-            #obj = types.cast_json(raw_obj)
-            #obj["timestamp"] = obj["timestamp"].isoformat()
-
-            bucketNumber = getBucketNumber(obj, bucketSize)
-            if bucketNumber > 0:
-                if bucketNumber >= len(outputFiles):
-                    newFilenames = [str(outputPath / (f"tosort-wikiconv-sort-{sortBy}-{fileIndex(i, sortBy)}.json")) for i in range(len(outputFiles), bucketNumber + 1)]
-                    newOutputFiles = [file_utils.output_writer(path=filename, compression=compression) for filename in newFilenames]
-                    outputFilesNames.extend(newFilenames)
-                    outputFiles.extend(newOutputFiles)
-
-                outputFiles[bucketNumber].write(f"{comparatorString(obj)}\t{json.dumps(obj)}\n")
-
-            if (nobjs-1) % NPRINTREVISION == 0:
-                utils.dot()
-            nobjs += 1
+        nlines = 0
+        written = 0
+        timers = metrics.Timers()
+        startTime = lastProgress = time.perf_counter()
+        compressionSeconds = file_utils.compression_seconds()
+        dump = file_utils.open_jsonlines_file(str(inputFile))
+        offset = 0 if offsets is None else offsets.get(str(inputFile), 0)
+        if offset:
+            file_utils.skip(dump, offset)
+        startOffset = checkpointOffset = offset
+
+        #process lines in batches
+        while True:
+            with timers.time('read'):
+                batch = dump.readlines(SPLIT_BATCH_SIZE)
+            if not batch:
+                break
+            offset += sum(map(len, batch))
+            nlines += len(batch)
+            if recordFilter is not None:
+                with timers.time('filter'):
+                    batch = list(filter(recordFilter, batch))
+
+            # The raw lines are written as they are, without re-encoding them
+            if batch and not batch[-1].endswith(b'\n'):
+                batch[-1] += b'\n'
+            with timers.time('decode'):
+                objs = list(map(fields.extract, batch))
+
+            for field, getBucketNumber, sortKey, fieldBoundaries in sorts:
+                # Keyed lines of each bucket, written together
+                groups = {}
+                with timers.time('key'):
+                    for obj, line in zip(objs, batch):
+                        bucketNumber = getBucketNumber(obj, bucketSize)
+                        if bucketNumber <= 0:
+                            continue
+                        key = sortKey(obj)
+                        if fieldBoundaries is not None:
+                            bucketNumber = bisect.bisect_right(fieldBoundaries, key) + 1
+                        group = groups.get(bucketNumber)
+                        if group is None:
+                            group = groups[bucketNumber] = []
+                        group.append(key + b'\t' + line)
+
+                with timers.time('write'):
+                    for bucketNumber, keyedLines in groups.items():
+                        bucketId = (field, bucketNumber)
+                        bucket = outputBuckets.get(bucketId)
+                        if bucket is None:
+                            filename = str(outputPath / (f"{BUCKET_FILE_PREFIX}{field}-{fileIndex(bucketNumber, field, fieldBoundaries is not None)}{shardSuffix}.json"))
+                            bucket = outputBuckets[bucketId] = buckets.Bucket(filename, compression, writerPool)
+
+                        size = sum(map(len, keyedLines))
+                        bucket.write_lines(keyedLines, size)
+                        written += size
+
+                        if bucket.in_memory:
+                            memorySize += size
+                            if bucket.size > inMemoryThreshold:
+                                memorySize -= bucket.size
+                                bucket.spill()
+                            elif memorySize > memoryLimit:
+                                largest = max((b for b in outputBuckets.values() if b.in_memory), key=lambda b: b.size)
+                                memorySize -= largest.size
+                                largest.spill()
+                        elif onSeal is not None and sealSize is not None and bucket.size >= sealSize:
+                            sealBucket(bucketId, bucket, onSeal)
+
+            if onSeal is not None and checkpointSize is not None and offset - checkpointOffset >= checkpointSize:
+                checkpoint(inputFile, offset, False)
+                checkpointOffset = offset
+
+            nobjs += len(batch)
+            now = time.perf_counter()
+            if now - lastProgress >= PROGRESS_INTERVAL:
+                metrics.emit(outputPath, 'progress', file=str(inputFile), shard=shard, records=nobjs, bytesRead=offset - startOffset, seconds=round(now - startTime, 3))
+                lastProgress = now
 
         dump.close()
-        printTimestamp(outputPath, f"Done Analyzing {inputFile}.")
+        seconds = time.perf_counter() - startTime
+        utils.log(f"Done analyzing {inputFile}.")
+        metrics.emit(
+            outputPath,
+            'split',
+            file=str(inputFile),
+            shard=shard,
+            session=session,
+            lines=nlines,
+            records=nobjs,
+            bytesRead=offset - startOffset,
+            bytesWritten=written,
+            seconds=round(seconds, 3),
+            recordsPerSecond=round(nobjs / seconds, 1) if seconds else None,
+            compressionSeconds=round(file_utils.compression_seconds() - compressionSeconds, 3),
+            **timers.values()
+        )
+
+        if onSeal is not None:
+            checkpoint(inputFile, offset, True)
 
 
     # Closing output files
-    for f in outputFiles:
-        f.close()
-
-    # Sort files
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        # executor.map(sort, outputFilesNames)
-        executor.map(lambda f: sort(f, compression, outputPath), outputFilesNames)
-        #executor.submit()
+    for bucket in outputBuckets.values():
+        bucket.close()
 
-    # for filename in outputFilesNames:
-    #     sort(filename, compression)
+    return outputBuckets
 
-    printTimestamp(outputPath, f"All done!")
 
+def sortFiles(
+        inputFiles: Iterable[Path],
+        outputPath: Path,
+        bucketSize: int,
+        compression: str,
+        sortBy: Union[str, List[str]],
+        splitWorkers: int = 1,
+        memoryLimit: int = external_sort.DEFAULT_MEMORY_LIMIT,
+        tmpDir: Optional[str] = None,
+        inMemoryThreshold: int = DEFAULT_IN_MEMORY_THRESHOLD,
+        maxOpenFiles: Optional[int] = None,
+        balancedBuckets: Optional[int] = None,
+        sampleEvery: int = DEFAULT_SAMPLE_EVERY,
+        ipBuckets: int = 1,
+        sortJobs: Optional[int] = None,
+        overlapSort: bool = False,
+        sealSize: Optional[int] = None,
+        resume: bool = False,
+        checkpointSize: Optional[int] = None,
+        incremental: bool = False,
+        index: bool = False,
+        outputFormat: str = 'json',
+        recordFilter: Optional[filters.RecordFilter] = None,
+        profile: bool = False,
+        tmpCompression: Optional[str] = None,
+        compressionThreads: Optional[int] = None
+    ) -> None:
+    """Sort the records of the input files into the output files.
+
+    When `sortBy` is a list of fields, the input files are split once into
+    the buckets of all of them, which are sorted by the same processes.
+    `memoryLimit` is shared by the processes splitting the input files, and
+    then by the `sortJobs` processes sorting the buckets.
+
+    With `balancedBuckets` the input files are sampled first, and the
+    records split into that many buckets of about the same size for each
+    field.
+
+    With `overlapSort` the records of each bucket are sorted into runs at
+    the end of each input file, or when they reach `sealSize`, while the
+    next records are split. The runs of each bucket are merged at the end.
+    Splitting and sorting then share `memoryLimit`.
+
+    The sorted output files are saved in the manifest of the run. With
+    `checkpointSize`, or with `resume`, the split is also saved at the end
+    of each input file and every `checkpointSize` bytes of it, writing the
+    buckets kept in memory to sorted runs. With `resume` an interrupted
+    run goes on from its last checkpoint, skipping the input files already
+    split and the output files already sorted.
+
+    With `incremental` the input files are added to the finished run in
+    `outputPath`: only their records are split and sorted, and merged into
+    the output files of their buckets. The other output files are left as
+    they are.
+
+    With `index` each output file gets a sparse index of its sort keys, see
+    `lookup`. With `outputFormat` parquet the output files are Parquet
+    files compressed with `compression`, see `columnar`.
+
+    Only the records kept by `recordFilter` are sorted.
+
+    The output files are compressed with `compression`, the bucket files
+    and their runs, which are removed once the run is finished, with
+    `tmpCompression`. Each process compresses its files with
+    `compressionThreads` threads, by default with its share of the
+    processors.
+
+    The metrics of the run are appended to its metrics file, see `metrics`.
+    With `profile` the split and the sort jobs are profiled, each process
+    saving its own statistics.
+    """
+    if outputFormat == 'parquet':
+        columnar.check_available()
+        if incremental or index:
+            raise ValueError("Parquet files can not be indexed or added to")
+    else:
+        file_utils.check_compression(compression)
+    file_utils.check_compression(tmpCompression)
+    if compressionThreads is not None:
+        file_utils.set_compression_threads(compressionThreads)
+    # Parquet files are compressed internally
+    outputCompression = None if outputFormat == 'parquet' else compression
+    outputSuffix = columnar.PARQUET_SUFFIX if outputFormat == 'parquet' else '.json'
 
-def sort(filename: str, compression: str, outputPath: str):
+    utils.log("Starting")
+    startTime = time.perf_counter()
 
-    utils.log(f"Sorting {filename}")
-    printTimestamp(outputPath, f"Sorting {filename}.")
-    if compression is None:
-        os.system(f"sort {filename} -o {filename.replace('tosort-wikiconv', 'wikiconv')}")
+    # outputFilesNames = [str(outputPath / (f"bucket-{str(i).zfill(4)}.json")) for i in range(math.ceil(nrOfPages / bucketSize))]
+    # outputFiles = [file_utils.output_writer(path=filename, compression=compression) for filename in outputFilesNames]
+    inputFiles = list(inputFiles)
+    sortBys = sortFields(sortBy)
+    if recordFilter is not None and not recordFilter:
+        recordFilter = None
+
+    settings = {
+        'sortBy': sortBys,
+        'bucketSize': bucketSize,
+        'ipBuckets': ipBuckets,
+        'balancedBuckets': balancedBuckets,
+        'compression': compression,
+        'tmpCompression': tmpCompression,
+        'outputFormat': outputFormat,
+        'filter': None if recordFilter is None else recordFilter.settings(),
+    }
+    if incremental:
+        state = manifest.RunState(outputPath, settings, resume=True)
+        state.add_inputs([str(inputFile) for inputFile in inputFiles])
     else:
-        filename += '.' + compression
-        compressCat = EXTENSIONS.get(compression, ['cat'])
-        compressor = 'gzip'
-        #os.system(f"{' '.join(compressCat)} {filename} | sort -o {filename.replace('bucket', 'sorted-bucket')}")
-        os.system(f"{' '.join(compressCat)} {filename} | sort | {compressor} > {filename.replace('tosort-wikiconv', 'wikiconv')}")
-    printTimestamp(outputPath, f"Done sorting {filename}.")
-
-
-def printTimestamp(outputPath: Path, description: str) -> None:
-    with open(str(outputPath / "times.txt"), "a") as f:
-        line = f'{datetime.now().strftime("%H:%M:%S")}: {description}\n'
-        f.write(line)
-        print(line)
+        settings['inputs'] = [str(inputFile) for inputFile in inputFiles]
+        state = manifest.RunState(outputPath, settings, resume)
+    if state.session:
+        utils.log(f"Resuming, session {state.session}.")
+    metrics.emit(
+        outputPath,
+        'start',
+        session=state.session,
+        settings=settings,
+        inputs=[str(inputFile) for inputFile in inputFiles],
+        incremental=incremental,
+        profile=profile
+    )
+
+    def profiled(name: str, fn: Callable) -> Callable:
+        # The function of a job, run under cProfile with `profile`
+        if not profile:
+            return fn
+        return functools.partial(metrics.profile_call, outputPath, f"{name}.s{state.session}", fn)
+
+    # Sample the input files to compute the bucket boundaries of each field
+    boundaries = None
+    if balancedBuckets is not None and state.data['boundaries'] is not None:
+        boundaries = {field: [bytes.fromhex(key) for key in fieldKeys] for field, fieldKeys in state.data['boundaries'].items()}
+    elif balancedBuckets is not None:
+        sampleTime = time.perf_counter()
+        samples = collections.defaultdict(list)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, splitWorkers)) as executor:
+            for fileSamples in executor.map(sampleFile, inputFiles, itertools.repeat(bucketSize), itertools.repeat(sortBys), itertools.repeat(sampleEvery), itertools.repeat(recordFilter)):
+                for field, fieldSamples in fileSamples.items():
+                    samples[field].extend(fieldSamples)
+        boundaries = {
+            field: computeBoundaries(samples[field], balancedBuckets, USER_BUCKET_STARTS if field in USER_SORTS else ())
+            for field in sortBys
+        }
+        state.data['boundaries'] = {field: [key.hex() for key in fieldKeys] for field, fieldKeys in boundaries.items()}
+        state.save()
+        for field, fieldBoundaries in boundaries.items():
+            utils.log(f"Done sampling {field}, {len(fieldBoundaries) + 1} buckets.")
+            metrics.emit(outputPath, 'sample', sortBy=field, buckets=len(fieldBoundaries) + 1, seconds=round(time.perf_counter() - sampleTime, 3))
+
+    # Without checkpoints the buckets kept in memory are not written, and an
+    # interrupted run splits its input files again
+    checkpoints = resume or checkpointSize is not None
+
+    splitMemoryLimit = memoryLimit // 2 if overlapSort else memoryLimit
+    sortMemoryLimit = memoryLimit - splitMemoryLimit if overlapSort else memoryLimit
+    sortScheduler = scheduler.Scheduler(sortJobs, sortMemoryLimit, compressionThreads)
+
+    # Files and runs of each bucket, and the runs sorted from its files
+    # while splitting, which are temporary
+    bucketFiles = collections.defaultdict(list)
+    bucketRuns = collections.defaultdict(list)
+    bucketSizes = collections.defaultdict(int)
+    sortedRuns = collections.defaultdict(list)
+    for bucketId, parts in state.bucket_parts().items():
+        bucketFiles[bucketId].extend(parts['files'])
+        bucketRuns[bucketId].extend(parts['runs'])
+        bucketSizes[bucketId] += parts['size']
+
+    # Parts sealed by each splitter since its last checkpoint
+    sealedParts = collections.defaultdict(list)
+    runJobs = itertools.count()
+
+    def onSeal(shard: Optional[int], bucketId: BucketId, filenames: List[str], runs: List[str], size: int) -> None:
+        sealedParts[shard].append((bucketId, filenames, runs, size))
+        if overlapSort and filenames:
+            job = next(runJobs)
+            sortScheduler.submit(
+                ('run', *bucketId, job),
+                size,
+                profiled(f"run-{bucketId[0]}-{bucketId[1]}-{job}", external_sort.sort_run),
+                filenames,
+                tmpCompression,
+                sortScheduler.job_memory_limit,
+                tmpDir,
+                callback=sortedRuns[bucketId].append
+            )
+
+    def onCheckpoint(shard: Optional[int], inputFile: str, offset: int, done: bool) -> None:
+        parts = sealedParts.pop(shard, [])
+        for bucketId, filenames, runs, size in parts:
+            if not overlapSort:
+                bucketFiles[bucketId].extend(filenames)
+            bucketRuns[bucketId].extend(runs)
+            bucketSizes[bucketId] += size
+        if checkpoints:
+            state.checkpoint(inputFile, offset, done, parts)
+
+    def onSorted(bucketId: BucketId, sortedFilename: str, mergedFilename: Optional[str], nrecords: int) -> None:
+        # The merged output replaces the base one only once it is recorded,
+        # so that the base is still there if the run is interrupted before
+        sortedPath = file_utils.compressed_path(sortedFilename, outputCompression)
+        if mergedFilename is None:
+            state.set_sorted(bucketId, Path(sortedPath).name, nrecords)
+        else:
+            mergedPath = file_utils.compressed_path(mergedFilename, outputCompression)
+            state.set_sorted(bucketId, Path(sortedPath).name, nrecords, os.path.getsize(mergedPath))
+            if index:
+                os.replace(sparse_index.index_path(mergedPath), sparse_index.index_path(sortedPath))
+            os.replace(mergedPath, sortedPath)
+        if not index:
+            # The index of an earlier run would not match the new file
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(sparse_index.index_path(sortedPath))
+        # Runs of the bucket are kept like its files, the temporary ones not
+        for run in sortedRuns.pop(bucketId, []):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(run)
+
+    try:
+        splitOptions = dict(
+            bucketSize=bucketSize,
+            compression=tmpCompression,
+            sortBy=sortBys,
+            inMemoryThreshold=inMemoryThreshold,
+            maxOpenFiles=maxOpenFiles,
+            boundaries=boundaries,
+            ipBuckets=ipBuckets,
+            sealSize=sealSize,
+            checkpointSize=checkpointSize,
+            keepInMemory=not checkpoints,
+            offsets={inputFile: state.split_offset(inputFile) for inputFile in map(str, inputFiles)},
+            session=state.session,
+            recordFilter=recordFilter
+        )
+        toSplit = [inputFile for inputFile in inputFiles if state.split_offset(str(inputFile)) is not None]
+        # Buckets returned by each splitter
+        splitBuckets = []
+
+        # Split dump, each worker writes its own shard of every bucket and
+        # sends the buckets it seals and its checkpoints through a queue
+        if splitWorkers > 1 and len(toSplit) > 1:
+            nworkers = min(splitWorkers, len(toSplit))
+            groups = [toSplit[i::nworkers] for i in range(nworkers)]
+            handlers = {'seal': onSeal, 'checkpoint': onCheckpoint}
+            with multiprocessing.Manager() as manager, \
+                    concurrent.futures.ProcessPoolExecutor(max_workers=nworkers) as executor:
+                eventQueue = manager.Queue()
+                futures = [
+                    executor.submit(
+                        profiled(f"split-w{shard}", splitFiles),
+                        group,
+                        outputPath,
+                        shard=shard,
+                        memoryLimit=splitMemoryLimit // nworkers,
+                        onSeal=functools.partial(putEvent, eventQueue, 'seal', shard),
+                        onCheckpoint=functools.partial(putEvent, eventQueue, 'checkpoint', shard),
+                        **splitOptions
+                    )
+                    for shard, group in enumerate(groups)
+                ]
+                running = set(futures)
+                while running:
+                    done, running = concurrent.futures.wait(running, timeout=0.1)
+                    with contextlib.suppress(queue.Empty):
+                        while True:
+                            kind, *event = eventQueue.get_nowait()
+                            handlers[kind](*event)
+                    for future in done:
+                        splitBuckets.append(future.result())
+        elif toSplit:
+            splitBuckets.append(profiled("split", splitFiles)(
+                toSplit,
+                outputPath,
+                memoryLimit=splitMemoryLimit,
+                onSeal=functools.partial(onSeal, None),
+                onCheckpoint=functools.partial(onCheckpoint, None),
+                **splitOptions
+            ))
+
+        # Buckets kept in memory are sorted without reading any file
+        bucketLines = collections.defaultdict(list)
+        for shardBuckets in splitBuckets:
+            for bucketId, bucket in shardBuckets.items():
+                if bucket.in_memory and bucket.lines:
+                    bucketLines[bucketId].extend(bucket.lines)
+                    bucketSizes[bucketId] += bucket.size
+
+        # Sort files, largest first, sealed runs are only merged
+        sortScheduler.wait()
+        bucketIds = sorted(bucketSizes)
+        sortedFilesNames = {
+            (field, i): str(outputPath / (f"wikiconv-sort-{field}-{fileIndex(i, field, boundaries is not None)}{outputSuffix}"))
+            for field, i in bucketIds
+        }
+        for i in bucketIds:
+            if state.sorted_records(i) is not None:
+                continue
+            base = state.base_output(i)
+            mergedFilename = None if base is None else f"{sortedFilesNames[i]}.merge"
+            sortScheduler.submit(
+                i,
+                bucketSizes[i] + (0 if base is None else base['size']),
+                profiled(f"sort-{i[0]}-{i[1]}", sort),
+                bucketFiles[i],
+                sortedFilesNames[i] if base is None else mergedFilename,
+                i[0],
+                compression,
+                outputPath,
+                sortScheduler.job_memory_limit,
+                tmpDir,
+                bucketLines.pop(i, ()),
+                sortedRuns[i],
+                None if base is None else sortedFilesNames[i],
+                index,
+                outputFormat,
+                tmpCompression,
+                bucketRuns[i],
+                callback=functools.partial(onSorted, i, sortedFilesNames[i], mergedFilename)
+            )
+        sortScheduler.wait()
+    finally:
+        sortScheduler.close()
+        # Outputs sorted since the last save are not sorted again on resume
+        state.flush()
+        # Runs sorted while splitting are not saved in the manifest
+        for runs in sortedRuns.values():
+            for run in runs:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(run)
+
+    state.finish()
+    removeBucketFiles(outputPath)
+
+    utils.log("All done!")
+    metrics.emit(outputPath, 'done', session=state.session, buckets=len(bucketIds), seconds=round(time.perf_counter() - startTime, 3))
+
+
+def sort(
+        filenames: List[str],
+        sortedFilename: str,
+        sortBy: str,
+        compression: str,
+        outputPath: Path,
+        memoryLimit: int = external_sort.DEFAULT_MEMORY_LIMIT,
+        tmpDir: Optional[str] = None,
+        lines: Iterable[bytes] = (),
+        runs: Iterable[str] = (),
+        base: Optional[str] = None,
+        index: bool = False,
+        outputFormat: str = 'json',
+        tmpCompression: Optional[str] = None,
+        bucketRuns: Iterable[str] = ()
+    ) -> int:
+    """Sort the files of a bucket, its lines kept in memory, its temporary
+    sorted runs and its sorted `bucketRuns` into a single file, compressed
+    with `compression`, and return the number of records. The files and
+    `bucketRuns` of the bucket are compressed with `tmpCompression`.
+
+    If given, the records of the sorted file `base` are merged with them.
+    With `index` the sorted file is indexed, see `sparse_index`. With
+    `outputFormat` parquet the sorted file is a Parquet file, see `columnar`.
+    The metrics of the sort are appended to the metrics file of `outputPath`.
+    """
+
+    utils.log(f"Sorting {sortedFilename}")
+    startTime = time.perf_counter()
+    compressionSeconds = file_utils.compression_seconds()
+    with contextlib.ExitStack() as stack:
+        sortedLines = []
+        writeOutput = None
+        if outputFormat == 'parquet':
+            writeOutput = functools.partial(columnar.write_lines, sortedFilename, compression, format_key=SORT_KEY_STRINGS[sortBy])
+        if base is not None:
+            baseFile = stack.enter_context(file_utils.input_reader(base, compression, binary=True))
+            sortedLines.append(map(functools.partial(parseSortedLine, sortBy=sortBy), baseFile))
+        nrecords = external_sort.sort_files(
+            filenames,
+            sortedFilename,
+            compression,
+            memory_limit=memoryLimit,
+            tmp_dir=tmpDir,
+            lines=lines,
+            format_line=functools.partial(formatSortedLine, sortBy=sortBy),
+            runs=runs,
+            sorted_lines=sortedLines,
+            index=index,
+            write_output=writeOutput,
+            input_compression=tmpCompression,
+            input_runs=bucketRuns
+        )
+    sortedPath = sortedFilename if outputFormat == 'parquet' else file_utils.compressed_path(sortedFilename, compression)
+    metrics.emit(
+        outputPath,
+        'sort',
+        sortBy=sortBy,
+        file=os.path.basename(sortedPath),
+        records=nrecords,
+        bytes=os.path.getsize(sortedPath),
+        seconds=round(time.perf_counter() - startTime, 3),
+        compressionSeconds=round(file_utils.compression_seconds() - compressionSeconds, 3)
+    )
+    return nrecords
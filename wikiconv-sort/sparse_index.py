@@ -0,0 +1,151 @@
+"""Sparse indexes of the sorted output files.
+
+The index of an output file has the sort key of the first record of each
+block of the file and the offset of the block, so that the records of a
+key range can be read without reading the whole file. gz, bz2, zst and
+lz4 files are written in blocks compressed independently, see
+`file_utils.BlockWriter`, which can be decompressed from the start of any
+block.
+
+The index is a text file next to the output file, with the hexadecimal
+sort key and the offset of a block on each line. Its last line has the
+sort key of the last record and the size of the file.
+"""
+import bisect
+import bz2
+import gzip
+import os
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from . import file_utils
+
+INDEX_SUFFIX = '.idx'
+# Records read at most to find the first one of a key range
+INDEX_BLOCK_SIZE = 256 * 1024
+INDEXED_COMPRESSIONS = {None, 'bz2', 'gz', 'lz4', 'zst'}
+
+
+def index_path(path: str) -> str:
+    """Return the path of the index of a file."""
+    return path + INDEX_SUFFIX
+
+
+class IndexedWriter:
+    """Writer of a sorted file and of its index.
+
+    Lines are written with their binary sort key, the part before the first
+    tab, and the index is written when the writer is closed.
+    """
+
+    def __init__(self, path: str, compression: Optional[str], block_size: int = INDEX_BLOCK_SIZE):
+        if compression not in INDEXED_COMPRESSIONS:
+            raise ValueError(f"Can not index {compression} files")
+        self.path = file_utils.compressed_path(path, compression)
+        self.block_size = block_size
+        self._file = file_utils.output_writer(path, compression, binary=True)
+        # Sort key and offset, or block number, of each block
+        self._blocks: List[Tuple[bytes, int]] = []
+        self._offset = 0
+        self._last_key = None
+
+    def write_lines(self, lines: Iterator[bytes], format_line: Optional[Callable[[bytes], bytes]] = None) -> int:
+        """Write the sorted lines, with `format_line` applied to them if
+        given, and return their number."""
+        nlines = 0
+        block = []
+        size = 0
+        for line in lines:
+            if not block:
+                self._blocks.append((line[:line.index(b'\t')], self._position()))
+            if format_line is not None:
+                last, line = line, format_line(line)
+            else:
+                last = line
+            block.append(line)
+            size += len(line)
+            if size >= self.block_size:
+                self._write_block(block)
+                nlines += len(block)
+                block = []
+                size = 0
+        if block:
+            self._write_block(block)
+            nlines += len(block)
+        if nlines:
+            self._last_key = last[:last.index(b'\t')]
+        return nlines
+
+    def _position(self) -> int:
+        if isinstance(self._file, file_utils.BlockWriter):
+            return self._file.blocks
+        return self._offset
+
+    def _write_block(self, block: List[bytes]) -> None:
+        data = b''.join(block)
+        self._file.write(data)
+        self._offset += len(data)
+        if isinstance(self._file, file_utils.BlockWriter):
+            self._file.end_block()
+
+    def close(self) -> None:
+        """Close the file and write its index."""
+        self._file.close()
+        offsets = self._file.offsets if isinstance(self._file, file_utils.BlockWriter) else None
+        with open(index_path(self.path), 'w', encoding='ascii') as f:
+            for key, position in self._blocks:
+                f.write(f"{key.hex()}\t{position if offsets is None else offsets[position]}\n")
+            if self._last_key is not None:
+                f.write(f"{self._last_key.hex()}\t{os.path.getsize(self.path)}\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_index(path: str) -> List[Tuple[bytes, int]]:
+    """Return the sort keys and offsets in the index of a file."""
+    with open(index_path(path), encoding='ascii') as f:
+        return [(bytes.fromhex(key), int(offset)) for key, offset in (line.split('\t') for line in f)]
+
+
+def read_range(
+        path: str,
+        start: bytes,
+        end: bytes,
+        line_key: Callable[[bytes], bytes],
+        entries: Optional[List[Tuple[bytes, int]]] = None
+    ) -> Iterator[bytes]:
+    """Yield the lines of an indexed sorted file whose sort key, returned by
+    `line_key`, is between `start` and `end`, included.
+
+    Only the blocks from the one before the first block starting at `start`
+    are read. The `entries` of the index are read if not given.
+    """
+    if entries is None:
+        entries = read_index(path)
+    if not entries or entries[-1][0] < start or entries[0][0] > end:
+        return
+    first_keys = [key for key, _ in entries[:-1]]
+    offset = entries[max(0, bisect.bisect_left(first_keys, start) - 1)][1]
+
+    with open(path, 'rb') as raw:
+        raw.seek(offset)
+        if path.endswith('.gz'):
+            f = gzip.GzipFile(fileobj=raw, mode='rb')
+        elif path.endswith('.bz2'):
+            f = bz2.BZ2File(raw, 'rb')
+        elif path.endswith('.zst'):
+            f = file_utils.zstd_reader(raw)
+        elif path.endswith('.lz4'):
+            f = file_utils.lz4.frame.LZ4FrameFile(raw, 'rb')
+        else:
+            f = raw
+        with f:
+            for line in f:
+                key = line_key(line)
+                if key > end:
+                    break
+                if key >= start:
+                    yield line
@@ -0,0 +1,127 @@
+"""Stream of all the records of the sorted output files of a run, in the
+order of their sort keys.
+
+    python -m wikiconv-sort.stream OUTPUT_DIR --sort-by date > wikiconv-by-date.json
+
+The output files are read one after the other by bucket number, which
+follows the order of the sort keys, in a background thread that
+decompresses them a few blocks ahead of the reader, from one file into the
+next, so that the whole output is streamed in constant memory.
+"""
+import argparse
+import io
+import json
+import os
+import pathlib
+import sys
+from typing import Iterator, List, Optional
+
+from . import file_utils
+from . import lookup
+from . import manifest
+
+
+def output_blocks(paths: List[str], compression: Optional[str]) -> Iterator[bytes]:
+    """Yield the decompressed data of the output files, one after the
+    other, given without the extension of `compression`."""
+    for path in paths:
+        if compression == 'bz2':
+            # Written by a `BlockWriter`, as independent streams
+            yield from file_utils.parallel_bz2_blocks(file_utils.compressed_path(path, compression))
+            continue
+        with file_utils.input_reader(path, compression, binary=True) as f:
+            yield from file_utils.read_blocks(f)
+
+
+class Stream:
+    """Stream of the records in the sorted output files of a run, sorted by
+    `sort_by`, which can be omitted if the run was sorted by a single field.
+
+    Each iteration of `lines` or `records` reads the output files again.
+    """
+
+    def __init__(self, output_path: pathlib.Path, sort_by: Optional[str] = None):
+        self.output_path = pathlib.Path(output_path)
+        self.manifest, self.sort_by = lookup.read_finished(self.output_path, sort_by)
+        if self.manifest.get('outputFormat', 'json') != 'json':
+            raise ValueError(f"The output files of the run in {self.output_path} are not JSON lines")
+        self.compression = self.manifest['compression']
+
+    def paths(self) -> List[str]:
+        """Return the paths of the output files, in the order of their sort
+        keys, without the extension of their compression."""
+        buckets = sorted(
+            (bucket for bucket in self.manifest['buckets'] if bucket['sortBy'] == self.sort_by),
+            key=lambda bucket: bucket['bucket']
+        )
+        suffix = file_utils.compressed_path('', self.compression)
+        paths = []
+        for bucket in buckets:
+            path = str(self.output_path / bucket['filename'])
+            paths.append(path[:-len(suffix)] if suffix else path)
+        return paths
+
+    def lines(self) -> Iterator[bytes]:
+        """Yield the sorted lines of all the records, with their readable
+        sort key."""
+        blocks = output_blocks(self.paths(), self.compression)
+        raw = file_utils.BackgroundReader(blocks, blocks.close)
+        with io.BufferedReader(raw, file_utils.DECOMPRESSION_BLOCK_SIZE) as f:
+            yield from f
+
+    def records(self) -> Iterator[dict]:
+        """Yield all the records, parsed, in the order of their sort keys."""
+        for line in self.lines():
+            yield json.loads(line.split(b'\t', 1)[1])
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self.lines()
+
+
+def get_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='wikiconv-stream',
+        description='Print all the records of the sorted files of a run, in order.',
+    )
+    parser.add_argument(
+        'output_dir_path',
+        metavar='OUTPUT_DIR',
+        type=pathlib.Path,
+        help='Output directory of a finished run.',
+    )
+    parser.add_argument(
+        '--sort-by',
+        choices={'user', 'page', 'replyToUser', 'date'},
+        required=False,
+        default=None,
+        help='Sorting field of the files, if the run was sorted by several.'
+    )
+    parser.add_argument(
+        '--records-only',
+        action='store_true',
+        help='Print only the JSON records, without their sort key.'
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = get_args()
+    try:
+        stream = Stream(args.output_dir_path, args.sort_by)
+        for line in stream.lines():
+            if args.records_only:
+                line = line.split(b'\t', 1)[1]
+            sys.stdout.buffer.write(line)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        # The reader of the output stopped early, e.g. head
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except (OSError, ValueError, manifest.ManifestError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
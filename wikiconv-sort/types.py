@@ -4,7 +4,7 @@ Extract snapshots from list of revisions.
 The output format is csv.
 """
 
-from typing import Mapping
+from typing import Mapping, Union
 from datetime import datetime
 
 
@@ -50,6 +50,7 @@ from datetime import datetime
 #     user: Mapping
 #     user['id']: int
 #     user['text']: str
+#     replyToUser: Mapping
 #     timestamp: str
 #     pageId: int
 #     parentId: str
@@ -67,8 +68,11 @@ from datetime import datetime
 #     score.identityAttack: float
 #     pageNamespace: int
 
-def __parse_user(userdct: Mapping) -> Mapping:
-    if "id" in userdct:
+def __parse_user(userdct: Union[Mapping, str]) -> Mapping:
+    # Some users are only a name, e.g. "root" or "unknown"
+    if isinstance(userdct, str):
+        return {"text": userdct}
+    elif "id" in userdct:
         return {"id": int(userdct["id"]),
                 "text": userdct["text"]
                 }
@@ -76,8 +80,10 @@ def __parse_user(userdct: Mapping) -> Mapping:
         return userdct
 
 
-def __parse_author(authordct: Mapping) -> Mapping:
-    if "id" in authordct:
+def __parse_author(authordct: Union[Mapping, str]) -> Mapping:
+    if isinstance(authordct, str):
+        return {"text": authordct}
+    elif "id" in authordct:
         return {"id": int(authordct["id"]),
                 "text": authordct["text"]}
     else:
@@ -92,7 +98,8 @@ def cast_json(dct: Mapping) -> Mapping:
            "pageTitle": dct["pageTitle"],
            "content": dct["content"],
            "cleanedContent": dct["cleanedContent"],
-           "user": __parse_user(dct.get("user", {})),
+           "user": __parse_user(dct.get("user") or {}),
+           "replyToUser": __parse_user(dct.get("replyToUser") or {}),
            # How do I parse an ISO 8601-formatted date?
            # https://stackoverflow.com/a/62769371/2377454
            "timestamp": datetime.fromisoformat(
@@ -93,6 +93,20 @@ def log(*args):
     print('\n' + str(first), *rest, end='', file=sys.stderr, flush=True)
 
 
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size: str) -> int:
+    """Parse a size in bytes with an optional suffix, e.g. "512M" or "2G"."""
+    size = size.strip().upper().rstrip('B')
+    suffix = size[-1:] if size[-1:] in SIZE_SUFFIXES else ''
+    number = size[:len(size) - len(suffix)]
+    try:
+        return int(float(number) * SIZE_SUFFIXES[suffix])
+    except ValueError as err:
+        raise ValueError(f"invalid size: {size!r}") from err
+
+
 def remove_comments(source: str) -> str:
     """Remove all the html comments from a string."""
     pattern = re.compile(r'<!--(.*?)-->', re.MULTILINE | re.DOTALL)